@@ -0,0 +1,197 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import data_gen  # noqa: E402
+import etl_loader  # noqa: E402
+from instrument import format_mb, peak_rss_mb, reset_peak_rss, round_mb  # noqa: E402
+import storage  # noqa: E402
+from storage_backends import benchmark_queries  # noqa: E402
+
+results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Table sizes are the data_gen defaults times each scale
+DEFAULT_SCALES = [1, 10, 100]
+# Seconds between checks that a scale's child process is still alive
+CHILD_POLL_SECONDS = 5
+
+
+class Stages:
+    def __init__(self, scale, sizes):
+        self.scale, self.sizes, self.rows = scale, sizes, []
+
+    def run(self, stage, fn, rows=None):
+        reset_peak_rss()
+        started, cpu_started = time.perf_counter(), time.process_time()
+        result = fn()
+        seconds = time.perf_counter() - started
+        self.rows.append({
+            "scale": self.scale, **self.sizes, "stage": stage,
+            "seconds": seconds, "cpu_seconds": time.process_time() - cpu_started,
+            "rows": rows(result) if callable(rows) else rows,
+            "peak_rss_mb": round_mb(peak_rss_mb()),
+        })
+        print(f"  {stage:<28}{seconds:>9.3f}s{format_mb(self.rows[-1]['peak_rss_mb'], 10)}", flush=True)
+        return result
+
+
+def run_scale(scale, seed):
+    # One scale end to end in a temporary directory: generate, write CSV, parse
+    # CSV, bulk-load SQLite, refresh aggregates, then every dashboard query
+    sizes = {"donors": data_gen.NUM_DONORS * scale, "donations": data_gen.NUM_DONATIONS * scale,
+             "requests": data_gen.NUM_REQUESTS * scale}
+    stages = Stages(scale, sizes)
+    as_of = pd.Timestamp.today().normalize()
+    donors_seed, donations_seed, requests_seed = np.random.SeedSequence(seed).spawn(3)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        etl_loader.data_dir = workdir
+        db = os.path.join(workdir, "blood_inventory.db")
+
+        frames = {}
+        frames["donors"] = stages.run("generate:donors", lambda: data_gen.generate_donors(
+            np.random.default_rng(donors_seed), sizes["donors"]), len)
+        frames["donations"] = stages.run("generate:donations", lambda: data_gen.generate_donations(
+            np.random.default_rng(donations_seed), frames["donors"], sizes["donations"], as_of=as_of), len)
+        frames["hospital_requests"] = stages.run("generate:requests", lambda: data_gen.generate_requests(
+            np.random.default_rng(requests_seed), sizes["requests"], as_of=as_of), len)
+        frames["inventory"] = stages.run("generate:inventory", lambda: data_gen.generate_inventory(
+            data_gen.inventory_units(frames["donations"], as_of), as_of), len)
+
+        sink = data_gen.CsvSink(workdir)
+        for table, df in frames.items():
+            stages.run(f"csv_write:{table}", lambda: sink.write_rendered(table, *data_gen._render(df, True)), len(df))
+        frames.clear()
+
+        parsed = {}
+        for table in etl_loader.TABLES:
+            parsed[table] = stages.run(f"csv_parse:{table}", lambda: etl_loader.read_table(table)[0],
+                                       lambda df: len(df))
+
+        conn = sqlite3.connect(db)
+        backend = storage.SqliteStorage(db)
+        with etl_loader.stage_run(conn, "benchmark", backend) as run:
+            run["rows"] = sum(len(df) for df in parsed.values())
+            for table, df in parsed.items():
+                stages.run(f"sqlite_load:{table}", lambda: etl_loader.replace_table(conn, table, df, bulk=True), len(df))
+            parsed.clear()
+            changed = stages.run("sqlite_load:aggregates",
+                                 lambda: etl_loader.refresh_aggregates(conn, {}, as_of.date().isoformat()))
+            run["changed"] = [*etl_loader.TABLES, *changed]
+        conn.close()
+
+        for name, call in benchmark_queries(backend).items():
+            stages.run(f"query:{name}", call, len)
+    return stages.rows
+
+
+def _run_scale_child(scale, seed, results):
+    try:
+        results.put(("ok", run_scale(scale, seed)))
+    except Exception:
+        results.put(("error", traceback.format_exc()))
+
+
+def run_isolated(scale, seed):
+    # Each scale runs in a fresh process so peak RSS is not inherited from the last.
+    # Raises RuntimeError if the child fails or dies without sending its results.
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_scale_child, args=(scale, seed, results))
+    process.start()
+    while True:
+        try:
+            status, payload = results.get(timeout=CHILD_POLL_SECONDS)
+            break
+        except queue.Empty:
+            if process.is_alive():
+                continue
+            # The child may have sent its results just before exiting
+            try:
+                status, payload = results.get(timeout=1)
+                break
+            except queue.Empty:
+                raise RuntimeError(f"scale x{scale}: benchmark process exited with code "
+                                   f"{process.exitcode} without results") from None
+    process.join()
+    if status == "error":
+        raise RuntimeError(f"scale x{scale} failed:\n{payload}")
+    return payload
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    # Prints each stage's time relative to a previous results file
+    with open(baseline_path) as f:
+        baseline = {(r["scale"], r["stage"]): r["seconds"] for r in json.load(f)["results"]}
+    print(f"\nvs {baseline_path}")
+    for r in results:
+        before = baseline.get((r["scale"], r["stage"]))
+        if before:
+            print(f"  x{r['scale']:<5}{r['stage']:<28}{before:>9.3f}s ->{r['seconds']:>9.3f}s  ({r['seconds'] / before:.2f}x)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time data_gen -> etl_loader -> dashboard queries at several sizes.")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help=f"multiples of the data_gen default table sizes (default {DEFAULT_SCALES})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None,
+                        help="results JSON path (default benchmarks/results/pipeline-<commit>-<time>.json)")
+    parser.add_argument("--compare", default=None, help="earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+    if any(scale <= 0 for scale in args.scales):
+        parser.error("--scales must be positive")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    commit = git_commit()
+    results = []
+    for scale in args.scales:
+        print(f"scale x{scale}", flush=True)
+        try:
+            results += run_isolated(scale, args.seed)
+        except RuntimeError as e:
+            sys.exit(str(e))
+
+    output = args.output
+    if output is None:
+        os.makedirs(results_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(results_dir, f"pipeline-{commit or 'nogit'}-{stamp}.json")
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit, "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "seed": args.seed, "results": results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import queries  # noqa: E402
+import storage  # noqa: E402
+
+# Group-bys the dashboard's panels precompute, run directly over the base
+# tables, which is where a columnar engine matters at tens of millions of
+# donations, as (sql, params, date columns). Both backends take ? params; dates are bound as ISO text, which
+# SQLite compares as stored and DuckDB casts to DATE.
+RAW_QUERIES = {
+    "raw_live_inventory": ("""
+        SELECT blood_type, component, location_id, SUM(units) AS units
+        FROM donations
+        WHERE qc_pass AND donation_date <= ? AND expiry_date >= ?
+        GROUP BY blood_type, component, location_id
+    """, (date.today().isoformat(), date.today().isoformat()), None),
+    "raw_daily_donations": ("""
+        SELECT donation_date, SUM(units) AS units, COUNT(*) AS donations
+        FROM donations
+        GROUP BY donation_date
+        ORDER BY donation_date
+    """, (), ["donation_date"]),
+    "raw_request_status": ("""
+        SELECT status, COUNT(*) AS count, SUM(units_requested) AS units
+        FROM hospital_requests
+        GROUP BY status
+    """, (), None),
+}
+
+
+def benchmark_queries(backend):
+    # name -> zero-argument callable: the dashboard's panels (from queries.py,
+    # unfiltered) whose tables exist, then the raw group-bys
+    versions = queries.table_versions(backend)
+    calls = {name: (lambda name=name: queries.run(name, backend))
+             for name in queries.QUERIES if all(t in versions for t in queries.SOURCES[name])}
+    calls.update({name: (lambda sql=sql, params=params, dates=dates: backend.query(sql, params, dates))
+                  for name, (sql, params, dates) in RAW_QUERIES.items()})
+    return calls
+
+
+def result_rows(result):
+    return len(result) if hasattr(result, "__len__") else 1
+
+
+def time_query(call, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time the dashboard's queries on each storage backend.")
+    parser.add_argument("--backends", nargs="+", choices=list(storage.BACKENDS), default=list(storage.BACKENDS))
+    parser.add_argument("--repeat", type=int, default=5, help="runs per query (default 5)")
+    parser.add_argument("--json", default=None, help="also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    for name in args.backends:
+        backend = storage.open_storage(name)
+        for query, call in benchmark_queries(backend).items():
+            # The first run is a warm-up whose row count must match across backends
+            rows = result_rows(call())
+            timings = time_query(call, args.repeat)
+            results.append({"backend": name, "query": query, "rows": rows, "median_s": statistics.median(timings),
+                            "min_s": min(timings), "repeat": args.repeat})
+
+    print(f"{'query':<22}" + "".join(f"{name:>12}" for name in args.backends) + "   (median ms)")
+    for query in dict.fromkeys(r["query"] for r in results):
+        row = {r["backend"]: r["median_s"] for r in results if r["query"] == query}
+        print(f"{query:<22}" + "".join(f"{row[name] * 1000:>12.2f}" if name in row else f"{'-':>12}"
+                                       for name in args.backends))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    mismatched = []
+    for query in dict.fromkeys(r["query"] for r in results):
+        rows = {r["backend"]: r["rows"] for r in results if r["query"] == query}
+        if len(set(rows.values())) > 1:
+            mismatched.append(f"{query}: " + ", ".join(f"{name} {count} rows" for name, count in rows.items()))
+    if mismatched:
+        sys.exit("Backends returned different results:\n  " + "\n  ".join(mismatched))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
-from pathlib import Path
+import numpy as np
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
 from datetime import datetime
 
-DB_PATH = Path(__file__).parent.parent / "blood_inventory.db"
+import queries
+import storage
+
+# SQLite by default; BLOOD_STORAGE=duckdb reads the DuckDB replica the ETL publishes
+STORAGE = storage.open_storage()
+# Cached panels are keyed on the versions of the tables they read, so the TTL
+# only bounds how long superseded entries linger in memory
+CACHE_TTL = "1h"
+CACHE_MAX_ENTRIES = 256
+# Reruns per section kept for the diagnostics percentiles
+DIAGNOSTICS_WINDOW = 200
 
 st.set_page_config(
     page_title="Blood Inventory Dashboard",
@@ -12,65 +24,207 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-@st.cache_data
-def load_data():
-    conn = sqlite3.connect(DB_PATH)
-    donors = pd.read_sql("SELECT * FROM donors", conn)
-    donations = pd.read_sql("SELECT * FROM donations", conn, parse_dates=["donation_date","expiry_date"])
-    requests = pd.read_sql("SELECT * FROM hospital_requests", conn, parse_dates=["request_date","fulfilled_date"])
-    inventory = pd.read_sql("SELECT * FROM inventory", conn, parse_dates=["last_updated"])
-    conn.close()
-    return donors, donations, requests, inventory
+# Panels come from queries.py; these wrappers only add caching, keyed on the
+# versions of the tables each query reads (queries.SOURCES)
+def memory_bytes(data):
+    if isinstance(data, pd.DataFrame):
+        return int(data.memory_usage(deep=True).sum())
+    if isinstance(data, pd.Series):
+        return int(data.memory_usage(deep=True))
+    return 0
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+def load_filter_options(version):
+    cache_misses.add("filter_options")
+    return queries.filter_options(STORAGE)
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+def load_kpis(version):
+    cache_misses.add("kpis")
+    return queries.kpis(STORAGE)
+
+# Filterable panels keep one FilterIndex per data version, shared rather than
+# copied out of the cache (cache_resource), so a filter change only takes the
+# matching rows instead of querying and caching every filter combination
+@st.cache_resource(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+def load_filter_index(query, version):
+    cache_misses.add(query)
+    return queries.filter_index(query, STORAGE)
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+def load_donations_over_time(version):
+    cache_misses.add("daily_donations")
+    return queries.donations_over_time(STORAGE)
 
-donors_df, donations_df, requests_df, inventory_df = load_data()
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+def load_request_status(version):
+    cache_misses.add("request_status")
+    return queries.request_status(STORAGE)
 
+# Section -> recent render times in seconds, shared by every session so the
+# percentiles reflect real use rather than one viewer's reruns
+@st.cache_resource
+def render_times():
+    return defaultdict(lambda: deque(maxlen=DIAGNOSTICS_WINDOW))
+
+rerun_started = time.perf_counter()
 st.title("Blood Inventory Dashboard")
 
+# One tiny query per rerun tells which cached panels are stale
+versions = queries.table_versions(STORAGE)
+# A database from before the current ETL (no table_versions, or aggregates without
+# location_id) lacks the tables the always-shown panels read
+required = {table for query in ("filter_options", "kpis", "inventory_by_type", "donations_over_time", "request_status")
+            for table in queries.SOURCES[query]}
+if not required <= versions.keys():
+    st.info("Run `python src/etl_loader.py` to load the data and build the dashboard's tables.")
+    st.stop()
+footprint = {}
+# Per rerun: seconds per section and per cached load, and the loads whose
+# function body ran (cache misses); shown in the sidebar diagnostics
+timings = {}
+load_timings = {}
+cache_misses = set()
+
+def version_of(query):
+    return tuple(versions.get(table) for table in queries.SOURCES[query])
+
+def record_time(section, seconds):
+    timings[section] = seconds
+    render_times()[section].append(seconds)
+
+@contextmanager
+def timed(section):
+    # Times a dashboard section: its cached loads plus filtering and chart serialization
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(section, time.perf_counter() - started)
+
+def loaded(name, load, *args):
+    started = time.perf_counter()
+    data = load(*args)
+    load_timings[name] = time.perf_counter() - started
+    return data
+
+def tracked(name, load, *args):
+    # Loads a cached panel frame and records its in-memory size for the sidebar report
+    data = loaded(name, load, *args)
+    footprint[name] = memory_bytes(data)
+    return data
+
+def indexed(query, *filters):
+    # A filterable panel: its cached FilterIndex, then the selected rows reduced
+    index = loaded(query, load_filter_index, query, version_of(query))
+    footprint[query] = memory_bytes(index.frame)
+    return getattr(queries, query)(*filters, index=index)
+
 # Sidebar filters
 st.sidebar.header("Filters")
-blood_types = sorted(donors_df["blood_type"].unique())
-components = sorted(inventory_df["component"].unique())
-locations = sorted(inventory_df["location_id"].unique())
-
-blood_type = st.sidebar.selectbox("Blood type", ["All"]+blood_types)
-component = st.sidebar.selectbox("Component", ["All"]+components)
-location = st.sidebar.selectbox("Location", ["All"]+locations)
-
-# Filter inventory
-inv = inventory_df.copy()
-if blood_type != "All":
-    inv = inv[inv["blood_type"]==blood_type]
-if component != "All":
-    inv = inv[inv["component"]==component]
-if location != "All":
-    inv = inv[inv["location_id"]==location]
+with timed("filters"):
+    blood_types, components, locations = loaded("filter_options", load_filter_options, version_of("filter_options"))
+
+    blood_type = st.sidebar.selectbox("Blood type", ["All"]+blood_types)
+    component = st.sidebar.selectbox("Component", ["All"]+components)
+    location = st.sidebar.selectbox("Location", ["All"]+locations)
 
 # KPIs
-col1, col2, col3, col4 = st.columns(4)
-col1.metric("Total Donors", donors_df.shape[0])
-col2.metric("Total Donated Units", donations_df["units"].sum())
-col3.metric("Total Inventory Units", inventory_df["units_available"].sum())
-col4.metric("Total Requests", requests_df.shape[0])
+with timed("kpis"):
+    kpis = tracked("kpis", load_kpis, version_of("kpis"))
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Total Donors", int(kpis["total_donors"]))
+    col2.metric("Total Donated Units", int(kpis["total_donated_units"]))
+    col3.metric("Donated Units (30 days)", int(kpis["donated_units_30d"]))
+    col4.metric("Total Inventory Units", int(kpis["total_inventory_units"]))
+    col5.metric("Total Requests", int(kpis["total_requests"]))
 
 # Layout
 left, right = st.columns(2)
 
 with left:
-    st.subheader("Inventory by blood type & component")
-    chart = inv.groupby(["blood_type","component"])["units_available"].sum().unstack()
-    st.bar_chart(chart)
+    with timed("inventory_by_type"):
+        st.subheader("Inventory by blood type & component")
+        by_type = indexed("inventory_by_type", blood_type, component, location)
+        st.bar_chart(by_type)
 
-    st.subheader("Low stock blood types (<7 units)")
-    low = inv.groupby("blood_type")["units_available"].sum()
-    low = low[low<7]
-    if not low.empty:
-        st.write(low)
+    with timed("low_stock"):
+        st.subheader("Low days of supply")
+        if "days_of_supply" in versions:
+            alerts = indexed("low_stock", blood_type, component, location)
+            st.caption("Available units over average daily demand; thresholds per component in `supply_thresholds`")
+            if not alerts.empty:
+                st.dataframe(alerts, hide_index=True)
+        else:
+            st.info("Run `python src/etl_loader.py` to compute days of supply.")
 
 with right:
-    st.subheader("Donations over time")
-    if not donations_df.empty:
-        daily = donations_df.groupby("donation_date")["units"].sum()
-        st.line_chart(daily)
+    with timed("daily_donations"):
+        st.subheader("Donations over time")
+        daily = tracked("daily_donations", load_donations_over_time, version_of("donations_over_time"))
+        if not daily.empty:
+            st.line_chart(daily)
+
+    with timed("request_status"):
+        st.subheader("Requests status")
+        status = tracked("request_status", load_request_status, version_of("request_status"))
+        st.bar_chart(status)
+
+with timed("expiry_and_wastage"):
+    st.subheader("Expiry and wastage")
+    if "expiry_forecast" in versions:
+        left, right = st.columns(2)
+        with left:
+            st.caption("Unallocated units expiring, by last usable day")
+            expiring = indexed("expiry_forecast", blood_type, component, location)
+            if not expiring.empty:
+                st.bar_chart(expiring)
+        with right:
+            st.caption("Wastage rate: expired and QC-discarded units over units collected, trailing window")
+            wastage = indexed("wastage_rate", blood_type, component, location)
+            if not wastage.empty:
+                st.line_chart(wastage)
+    else:
+        st.info("Run `python src/wastage.py` to project expiries and wastage rates.")
+
+with timed("demand"):
+    st.subheader("Demand forecast (units requested per day)")
+    if "demand_forecast" in versions:
+        demand = indexed("demand", blood_type, component)
+        if not demand.empty:
+            st.line_chart(demand)
+    else:
+        st.info("Run `python src/demand_forecast.py` to forecast demand.")
+
+record_time("rerun", time.perf_counter() - rerun_started)
+
+with st.sidebar.expander("Memory footprint"):
+    sizes = pd.Series(footprint, name="bytes")
+    st.dataframe(sizes.to_frame())
+    st.caption(f"Total: {sizes.sum() / 1024:.1f} KiB across {len(sizes)} cached frames")
 
-    st.subheader("Requests status")
-    st.bar_chart(requests_df["status"].value_counts())
+if st.sidebar.toggle("Diagnostics", help="Render time per section for this rerun and across recent reruns of every session"):
+    with st.sidebar.expander("Render times", expanded=True):
+        # Other sessions append to the shared deques from their own threads, so each
+        # one is copied once (list() of a deque is atomic) before it is read
+        history = {section: list(render_times()[section]) for section in timings}
+        report = pd.DataFrame([
+            {
+                "section": section,
+                "ms": seconds * 1000,
+                "p50 ms": np.percentile(history[section], 50) * 1000,
+                "p95 ms": np.percentile(history[section], 95) * 1000,
+                "reruns": len(history[section]),
+            }
+            for section, seconds in timings.items()
+        ])
+        st.dataframe(report, hide_index=True, column_config={
+            col: st.column_config.NumberColumn(format="%.1f") for col in ("ms", "p50 ms", "p95 ms")
+        })
+        loads = pd.DataFrame({
+            "load": list(load_timings),
+            "ms": [seconds * 1000 for seconds in load_timings.values()],
+            "cache": ["miss" if name in cache_misses else "hit" for name in load_timings],
+        })
+        st.dataframe(loads, hide_index=True, column_config={"ms": st.column_config.NumberColumn(format="%.1f")})
+        st.caption(f"Percentiles over the last {DIAGNOSTICS_WINDOW} reruns per section; a section's time includes its cached load")
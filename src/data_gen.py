@@ -1,11 +1,22 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datetime import datetime, timedelta
 import random
 import uuid
 from pathlib import Path
+import argparse
+import shutil
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 import os
 
+import etl_loader
+from domain import BLOOD_TYPES, COMPONENTS, LOCATIONS, SHELF_LIFE_DAYS
+
 # DATA_DIR = Path(__file__).parent / "data"
 # DATA_DIR.mkdir(exist_ok=True)
 
@@ -15,93 +26,419 @@ project_root = os.path.abspath(os.path.join(current_dir, ".."))
 data_dir = os.path.join(project_root, "data")
 os.makedirs(data_dir, exist_ok=True)
 
+db_path = os.path.join(project_root, "blood_inventory.db")
+
 # Config
 NUM_DONORS = 500
 NUM_DONATIONS = 5000
 NUM_REQUESTS = 200
-LOCATIONS = ["center_1", "center_2", "mobile_drive_1"]
-BLOOD_TYPES = ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]
-COMPONENTS = ["plasma", "platelets", "whole_blood"]
-
-# Generate donors
-donors = []
-for i in range(NUM_DONORS):
-    dob = datetime(1955,1,1) + timedelta(days=random.randint(0, 20000))
-    donors.append({
-        "donor_id": f"D{i+1}",
-        "dob": dob.date(),
-        "blood_type": random.choice(BLOOD_TYPES)
+REQUEST_STATUSES = ["fulfilled", "pending", "cancelled"]
+REQUEST_STATUS_WEIGHTS = [0.6, 0.3, 0.1]
+URGENCIES = ["high", "medium", "low"]
+DOB_EPOCH = datetime(1955, 1, 1)
+HISTORY_DAYS = 90
+DATE_COLUMNS = {"dob", "donation_date", "expiry_date", "request_date", "fulfilled_date", "last_updated"}
+# Parquet datasets are hive-partitioned by the month of these columns
+PARQUET_PARTITIONS = {
+    "donations": ("donation_date", "donation_month"),
+    "hospital_requests": ("request_date", "request_month"),
+}
+# Rows per independently seeded shard when --chunk-size is not given
+SHARD_ROWS = 100_000
+
+
+# --- Reference engine (one dict per row) ---
+def generate_donors_reference(num_donors):
+    donors = []
+    for i in range(num_donors):
+        dob = DOB_EPOCH + timedelta(days=random.randint(0, 20000))
+        donors.append({
+            "donor_id": f"D{i+1}",
+            "dob": dob.date(),
+            "blood_type": random.choice(BLOOD_TYPES)
+        })
+    return pd.DataFrame(donors)
+
+
+def generate_donations_reference(donors_df, num_donations, as_of=None):
+    anchor = pd.Timestamp(_anchor(as_of)).to_pydatetime()
+    donors = donors_df.to_dict("records")
+    donations = []
+    for i in range(num_donations):
+        donor = random.choice(donors)
+        donation_date = anchor - timedelta(days=random.randint(0, HISTORY_DAYS))
+        component = random.choice(COMPONENTS)
+        expiry_date = donation_date + timedelta(days=SHELF_LIFE_DAYS[component])
+        donations.append({
+            "donation_id": f"DN{i+1}",
+            "donor_id": donor["donor_id"],
+            "blood_type": donor["blood_type"],
+            "component": component,
+            "units": random.randint(1,3),
+            "donation_date": donation_date.date(),
+            "expiry_date": expiry_date.date(),
+            "location_id": random.choice(LOCATIONS),
+            "qc_pass": random.choice([True, True, True, False])  # ~75% pass
+        })
+    return pd.DataFrame(donations)
+
+
+def generate_requests_reference(num_requests, as_of=None):
+    anchor = pd.Timestamp(_anchor(as_of)).to_pydatetime()
+    requests = []
+    for i in range(num_requests):
+        bt = random.choice(BLOOD_TYPES)
+        comp = random.choice(COMPONENTS)
+        req_date = anchor - timedelta(days=random.randint(0, HISTORY_DAYS))
+        status = random.choices(REQUEST_STATUSES, weights=REQUEST_STATUS_WEIGHTS)[0]
+        fulfilled_date = req_date + timedelta(days=random.randint(0,5)) if status=="fulfilled" else pd.NaT
+        requests.append({
+            "request_id": f"R{i+1}",
+            "hospital_id": f"H{random.randint(1,10)}",
+            "blood_type": bt,
+            "component": comp,
+            "units_requested": random.randint(1,5),
+            "request_date": req_date.date(),
+            "status": status,
+            "urgency": random.choice(URGENCIES),
+            "fulfilled_date": fulfilled_date.date() if pd.notna(fulfilled_date) else ""
+        })
+    return pd.DataFrame(requests)
+
+
+# --- Vectorized engine (column arrays from a numpy Generator) ---
+def _ids(prefix, start, count):
+    return np.char.add(prefix, np.arange(start + 1, start + count + 1).astype(str))
+
+
+def _anchor(as_of):
+    # Last day of the generated history: as_of, or today when not given, so a
+    # seeded run gives the same rows on any day for the same as_of
+    return np.datetime64((pd.Timestamp.today() if as_of is None else pd.Timestamp(as_of)).date(), "D")
+
+
+def generate_donors(rng, num_donors):
+    dob = np.datetime64(DOB_EPOCH.date(), "D") + rng.integers(0, 20000, num_donors, endpoint=True)
+    return pd.DataFrame({
+        "donor_id": _ids("D", 0, num_donors),
+        "dob": dob,
+        "blood_type": np.asarray(BLOOD_TYPES)[rng.integers(0, len(BLOOD_TYPES), num_donors)],
     })
-donors_df = pd.DataFrame(donors)
-donors_df.to_csv(os.path.join(data_dir, "donors.csv"), index=False)
-
-# Generate donations
-donations = []
-for i in range(NUM_DONATIONS):
-    donor = random.choice(donors)
-    donation_date = datetime.today() - timedelta(days=random.randint(0, 90))
-    component = random.choice(COMPONENTS)
-    # expiry: plasma 42 days, platelets 5 days, whole_blood 35 days
-    if component == "plasma":
-        expiry_days = 42
-    elif component == "platelets":
-        expiry_days = 5
-    else:
-        expiry_days = 35
-    expiry_date = donation_date + timedelta(days=expiry_days)
-    donations.append({
-        "donation_id": f"DN{i+1}",
-        "donor_id": donor["donor_id"],
-        "blood_type": donor["blood_type"],
-        "component": component,
-        "units": random.randint(1,3),
-        "donation_date": donation_date.date(),
-        "expiry_date": expiry_date.date(),
-        "location_id": random.choice(LOCATIONS),
-        "qc_pass": random.choice([True, True, True, False])  # ~75% pass
+
+
+def generate_donations(rng, donors_df, num_donations, start=0, as_of=None):
+    donor_ids = donors_df["donor_id"].to_numpy()
+    donor_types = donors_df["blood_type"].to_numpy()
+    shelf_life = np.array([SHELF_LIFE_DAYS[c] for c in COMPONENTS])
+
+    donor_idx = rng.integers(0, len(donor_ids), num_donations)
+    donation_date = _anchor(as_of) - rng.integers(0, HISTORY_DAYS, num_donations, endpoint=True)
+    comp_idx = rng.integers(0, len(COMPONENTS), num_donations)
+    return pd.DataFrame({
+        "donation_id": _ids("DN", start, num_donations),
+        "donor_id": donor_ids[donor_idx],
+        "blood_type": donor_types[donor_idx],
+        "component": np.asarray(COMPONENTS)[comp_idx],
+        "units": rng.integers(1, 3, num_donations, endpoint=True),
+        "donation_date": donation_date,
+        "expiry_date": donation_date + shelf_life[comp_idx],
+        "location_id": np.asarray(LOCATIONS)[rng.integers(0, len(LOCATIONS), num_donations)],
+        "qc_pass": rng.random(num_donations) < 0.75,  # ~75% pass
     })
-donations_df = pd.DataFrame(donations)
-donations_df.to_csv(os.path.join(data_dir, "donations.csv"), index=False)
-
-# Generate requests
-requests = []
-for i in range(NUM_REQUESTS):
-    bt = random.choice(BLOOD_TYPES)
-    comp = random.choice(COMPONENTS)
-    req_date = datetime.today() - timedelta(days=random.randint(0, 90))
-    status = random.choices(["fulfilled","pending","cancelled"], weights=[0.6,0.3,0.1])[0]
-    fulfilled_date = req_date + timedelta(days=random.randint(0,5)) if status=="fulfilled" else pd.NaT
-    requests.append({
-        "request_id": f"R{i+1}",
-        "hospital_id": f"H{random.randint(1,10)}",
-        "blood_type": bt,
-        "component": comp,
-        "units_requested": random.randint(1,5),
-        "request_date": req_date.date(),
+
+
+def generate_requests(rng, num_requests, start=0, as_of=None):
+    req_date = _anchor(as_of) - rng.integers(0, HISTORY_DAYS, num_requests, endpoint=True)
+    status = rng.choice(np.asarray(REQUEST_STATUSES), num_requests, p=REQUEST_STATUS_WEIGHTS)
+    fulfilled_date = req_date + rng.integers(0, 5, num_requests, endpoint=True)
+    fulfilled_date = np.where(status == "fulfilled", fulfilled_date, np.datetime64("NaT"))
+    return pd.DataFrame({
+        "request_id": _ids("R", start, num_requests),
+        "hospital_id": np.char.add("H", rng.integers(1, 10, num_requests, endpoint=True).astype(str)),
+        "blood_type": np.asarray(BLOOD_TYPES)[rng.integers(0, len(BLOOD_TYPES), num_requests)],
+        "component": np.asarray(COMPONENTS)[rng.integers(0, len(COMPONENTS), num_requests)],
+        "units_requested": rng.integers(1, 5, num_requests, endpoint=True),
+        "request_date": req_date,
         "status": status,
-        "urgency": random.choice(["high","medium","low"]),
-        "fulfilled_date": fulfilled_date if pd.notna(fulfilled_date) else ""
+        "urgency": np.asarray(URGENCIES)[rng.integers(0, len(URGENCIES), num_requests)],
+        "fulfilled_date": fulfilled_date,
     })
-requests_df = pd.DataFrame(requests)
-requests_df.to_csv(os.path.join(data_dir, "hospital_requests.csv"), index=False)
+
 
 # Generate inventory as snapshot from donations
-inventory_list = []
-for bt in BLOOD_TYPES:
-    for comp in COMPONENTS:
-        units = donations_df[(donations_df["blood_type"]==bt) & 
-                            (donations_df["component"]==comp) & 
-                            (donations_df["qc_pass"]==True)]["units"].sum()
-        inventory_list.append({
-            "inventory_id": f"I_{bt}_{comp}",
-            "blood_type": bt,
-            "component": comp,
-            "units_available": units,
-            "location_id": random.choice(LOCATIONS),
-            "last_updated": datetime.today().date(),
-            "notes": ""
-        })
-inventory_df = pd.DataFrame(inventory_list)
-inventory_df.to_csv(os.path.join(data_dir, "inventory.csv"), index=False)
+INVENTORY_KEYS = ["blood_type", "component", "location_id"]
+
+
+def inventory_units(donations_df, as_of):
+    # QC-passed units donated on or before as_of that have not yet expired
+    donation_date = pd.to_datetime(donations_df["donation_date"])
+    expiry_date = pd.to_datetime(donations_df["expiry_date"])
+    live = donations_df["qc_pass"].astype(bool) & (donation_date <= as_of) & (expiry_date >= as_of)
+    return donations_df[live].groupby(INVENTORY_KEYS)["units"].sum()
+
+
+def generate_inventory(units, as_of):
+    inventory_df = units.astype("int64").rename("units_available").reset_index()
+    inventory_df.insert(0, "inventory_id", "I_" + inventory_df["blood_type"] + "_"
+                        + inventory_df["component"] + "_" + inventory_df["location_id"])
+    inventory_df["last_updated"] = as_of.date()
+    inventory_df["notes"] = ""
+    return inventory_df[["inventory_id", "blood_type", "component", "units_available",
+                         "location_id", "last_updated", "notes"]]
+
+
+# --- Output sinks ---
+def iter_chunks(total, chunk_size):
+    # An empty table still yields one empty chunk so the sink replaces stale output
+    for start in range(0, max(total, 1), chunk_size):
+        yield start, min(chunk_size, total - start)
+
+
+class CsvSink:
+    def __init__(self, directory):
+        self.directory = directory
+        self.started = set()
+
+    def write(self, name, df):
+        path = os.path.join(self.directory, f"{name}.csv")
+        first = name not in self.started
+        df.to_csv(path, mode="w" if first else "a", header=first, index=False)
+        self.started.add(name)
+
+    def write_rendered(self, name, columns, body):
+        path = os.path.join(self.directory, f"{name}.csv")
+        first = name not in self.started
+        with open(path, "w" if first else "a", newline="") as f:
+            if first:
+                f.write(",".join(columns) + "\n")
+            f.write(body)
+        self.started.add(name)
+
+    def close(self):
+        pass
+
+
+# Writes straight into the ETL's database through etl_loader's typed schema and
+# bulk writer, in one transaction recorded as an ETL run: indexes, aggregates and
+# table versions are brought up to date on close, exactly as a full CSV load
+# would leave them.
+class SqliteSink:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        etl_loader.ensure_state_table(self.conn)
+        etl_loader.ensure_files_table(self.conn)
+        # The run stays open across write() calls until close()
+        self.stack = ExitStack()
+        self.run = self.stack.enter_context(etl_loader.stage_run(self.conn, "data_gen"))
+        self.started = set()
+
+    def write(self, name, df):
+        if name not in self.started:
+            etl_loader.create_table(self.conn, name)
+            self.started.add(name)
+        # Dates as the CSV loader parses them, so they are stored as DATE text
+        df = df.assign(**{col: pd.to_datetime(df[col]) for col in etl_loader.TABLES[name][1] if col in df})
+        etl_loader.bulk_insert(self.conn, name, etl_loader.prepare_frame(name, df))
+        self.run["rows"] += len(df)
+
+    def close(self):
+        changed = sorted(self.started)
+        for table in changed:
+            etl_loader.create_indexes(self.conn, table)
+        # The tables no longer match any CSV or Parquet files, so the next
+        # incremental ETL run reloads them in full
+        for state_table in ("etl_state", "etl_files"):
+            self.conn.executemany(f"DELETE FROM {state_table} WHERE table_name = ?", ((t,) for t in changed))
+        if any(t in self.started for t in etl_loader.ALLOCATION_SOURCES) and etl_loader.drop_allocations(self.conn):
+            changed.append("allocations")
+        changed += etl_loader.refresh_aggregates(self.conn, {table: None for table in self.started},
+                                                 datetime.today().date().isoformat())
+        self.run["changed"] = changed
+        self.stack.close()
+        self.conn.close()
+
+
+class ParquetSink:
+    # One dataset directory per table (data/<table>/); every write adds new part
+    # files, partitioned by month for the large tables
+    def __init__(self, directory):
+        self.directory = directory
+        self.parts = {}
+
+    def write(self, name, df):
+        root = os.path.join(self.directory, name)
+        if name not in self.parts:
+            shutil.rmtree(root, ignore_errors=True)
+            os.makedirs(root)
+            self.parts[name] = 0
+        part = self.parts[name]
+        self.parts[name] += 1
+
+        df = df.copy()
+        for col in DATE_COLUMNS & set(df.columns):
+            df[col] = pd.to_datetime(df[col])
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        for col in DATE_COLUMNS & set(df.columns):
+            index = table.schema.get_field_index(col)
+            table = table.set_column(index, col, table.column(col).cast(pa.date32()))
+
+        if name not in PARQUET_PARTITIONS or df.empty:
+            # An empty table still gets one (unpartitioned) file carrying its schema
+            pq.write_table(table, os.path.join(root, f"part-{part:05d}.parquet"))
+            return
+        # Hive-style month directories, e.g. donations/donation_month=2025-04/part-00003.parquet
+        date_col, month_col = PARQUET_PARTITIONS[name]
+        months = df[date_col].dt.strftime("%Y-%m").to_numpy()
+        for month in np.unique(months):
+            month_dir = os.path.join(root, f"{month_col}={month}")
+            os.makedirs(month_dir, exist_ok=True)
+            pq.write_table(table.filter(pa.array(months == month)), os.path.join(month_dir, f"part-{part:05d}.parquet"))
+
+    def close(self):
+        pass
+
+
+# --- Sharded generation ---
+# Every shard gets its own child of the run's SeedSequence, so the output for a
+# given seed and shard size is identical whatever the number of workers.
+_worker_donors = None
+
+
+def _init_worker(donors_df):
+    global _worker_donors
+    _worker_donors = donors_df
+
+
+def _render(chunk, render_csv):
+    # CSV text is rendered in the worker so the parent process only appends it
+    if render_csv:
+        return list(chunk.columns), chunk.to_csv(index=False, header=False, lineterminator="\n")
+    return chunk
+
+
+def _donation_shard(task):
+    seed, start, count, as_of, render_csv = task
+    chunk = generate_donations(np.random.default_rng(seed), _worker_donors, count, start, as_of)
+    return _render(chunk, render_csv), inventory_units(chunk, as_of)
+
+
+def _request_shard(task):
+    seed, start, count, as_of, render_csv = task
+    return _render(generate_requests(np.random.default_rng(seed), count, start, as_of), render_csv)
+
+
+def _run_shards(executor, fn, tasks, window):
+    # Like executor.map, but with at most `window` shards in flight so finished
+    # shards are written out before the next ones are generated
+    if executor is None:
+        for task in tasks:
+            yield fn(task)
+        return
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate mock blood inventory data.")
+    parser.add_argument("--engine", choices=["vectorized", "reference"], default="vectorized",
+                        help="vectorized numpy engine (default) or the per-row reference loops")
+    parser.add_argument("--donors", type=int, default=NUM_DONORS)
+    parser.add_argument("--donations", type=int, default=NUM_DONATIONS)
+    parser.add_argument("--requests", type=int, default=NUM_REQUESTS)
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help=f"rows per generated/written donations and requests shard (default {SHARD_ROWS})")
+    parser.add_argument("--sink", choices=["csv", "parquet", "sqlite"], default="csv",
+                        help="write CSVs to data/ (default), Parquet datasets to data/<table>/, "
+                             "or load straight into blood_inventory.db as a full ETL run would")
+    parser.add_argument("--as-of", type=pd.Timestamp, default=None,
+                        help="last day of the generated history and the inventory snapshot date, YYYY-MM-DD (default: today)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for reproducible output (default: fresh entropy, printed)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="generate shards across this many processes")
+    args = parser.parse_args(argv)
+    if args.workers <= 0:
+        parser.error("--workers must be positive")
+    if args.workers > 1 and args.engine == "reference":
+        parser.error("--workers requires the vectorized engine")
+    if args.chunk_size is not None and args.chunk_size <= 0:
+        parser.error("--chunk-size must be positive")
+    if args.chunk_size is not None and args.engine == "reference":
+        parser.error("--chunk-size requires the vectorized engine")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    as_of = (args.as_of or pd.Timestamp.today()).normalize()
+    sink = {"csv": CsvSink, "parquet": ParquetSink}.get(args.sink, SqliteSink)(
+        db_path if args.sink == "sqlite" else data_dir)
+
+    if args.engine == "reference":
+        random.seed(args.seed)
+        donors_df = generate_donors_reference(args.donors)
+        donations_df = generate_donations_reference(donors_df, args.donations, as_of)
+        sink.write("donors", donors_df)
+        sink.write("donations", donations_df)
+        sink.write("hospital_requests", generate_requests_reference(args.requests, as_of))
+        sink.write("inventory", generate_inventory(inventory_units(donations_df, as_of), as_of))
+        sink.close()
+        print("Data generation complete.")
+        return
+
+    root_seed = np.random.SeedSequence(args.seed)
+    print(f"Seed: {root_seed.entropy}")
+    donors_seed, donations_seed, requests_seed = root_seed.spawn(3)
+
+    donors_df = generate_donors(np.random.default_rng(donors_seed), args.donors)
+    sink.write("donors", donors_df)
+
+    shard_rows = args.chunk_size or SHARD_ROWS
+    donation_shards = list(iter_chunks(args.donations, shard_rows))
+    request_shards = list(iter_chunks(args.requests, shard_rows))
+    render_csv = isinstance(sink, CsvSink)
+    donation_tasks = [(seed, start, count, as_of, render_csv) for seed, (start, count)
+                      in zip(donations_seed.spawn(len(donation_shards)), donation_shards)]
+    request_tasks = [(seed, start, count, as_of, render_csv) for seed, (start, count)
+                     in zip(requests_seed.spawn(len(request_shards)), request_shards)]
+
+    def write(name, shard):
+        if render_csv:
+            sink.write_rendered(name, *shard)
+        else:
+            sink.write(name, shard)
+
+    executor = None
+    if args.workers > 1:
+        executor = ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(donors_df,))
+    else:
+        _init_worker(donors_df)
+    window = 2 * args.workers
+
+    # Only the grouped live-unit totals are kept between shards
+    units = None
+    try:
+        for shard, shard_units in _run_shards(executor, _donation_shard, donation_tasks, window):
+            write("donations", shard)
+            units = shard_units if units is None else units.add(shard_units, fill_value=0)
+            del shard
+
+        for shard in _run_shards(executor, _request_shard, request_tasks, window):
+            write("hospital_requests", shard)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    sink.write("inventory", generate_inventory(units, as_of))
+    sink.close()
+
+    print("Data generation complete.")
+
 
-print("Data generation complete.")
+if __name__ == "__main__":
+    main()
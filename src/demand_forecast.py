@@ -0,0 +1,138 @@
+import pandas as pd
+import numpy as np
+import sqlite3
+import argparse
+import time
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import etl_loader
+
+# --- Paths ---
+current_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
+project_root = os.path.abspath(os.path.join(current_dir, ".."))
+db_path = os.path.join(project_root, "blood_inventory.db")
+
+# One demand series per hospital, blood type and component
+SERIES_KEYS = ["hospital_id", "blood_type", "component"]
+HORIZON_DAYS = 14
+# Smoothing factors tried per series; the one with the lowest one-step-ahead
+# squared error is kept
+ALPHAS = np.linspace(0.05, 0.95, 19)
+
+TABLE = {
+    "primary_key": "date, hospital_id, blood_type, component",
+    "columns": [
+        ("date", "DATE NOT NULL"),
+        ("hospital_id", "TEXT NOT NULL"),
+        ("blood_type", "TEXT NOT NULL"),
+        ("component", "TEXT NOT NULL"),
+        ("forecast_units", "REAL NOT NULL"),
+        ("alpha", "REAL NOT NULL"),
+        ("rmse", "REAL NOT NULL"),
+    ],
+}
+
+
+def read_demand(conn, as_of):
+    # Daily units requested per series on a dense (day x series) grid up to as_of;
+    # every request counts as demand whatever its status
+    rows = pd.read_sql("""
+        SELECT hospital_id, blood_type, component, request_date, SUM(units_requested) AS units
+        FROM hospital_requests
+        WHERE request_date <= ?
+        GROUP BY hospital_id, blood_type, component, request_date
+    """, conn, params=(as_of.date().isoformat(),), parse_dates=["request_date"])
+    if rows.empty:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="request_date"))
+    demand = rows.pivot_table(index="request_date", columns=SERIES_KEYS, values="units",
+                              aggfunc="sum", fill_value=0)
+    days = pd.date_range(demand.index.min(), as_of, freq="D", name="request_date")
+    return demand.reindex(days, fill_value=0)
+
+
+def fit_exponential_smoothing(y, alphas=ALPHAS):
+    # Simple exponential smoothing for every column of y (days x series) and
+    # every candidate alpha at once; returns the final level, alpha and
+    # one-step-ahead RMSE of the best alpha per series
+    y = np.asarray(y, dtype=np.float64)
+    a = np.asarray(alphas, dtype=np.float64)[:, None]
+    level = np.repeat(y[:1], len(a), axis=0)
+    sse = np.zeros_like(level)
+    for t in range(1, len(y)):
+        error = y[t] - level
+        sse += error * error
+        level = level + a * error
+    best = np.argmin(sse, axis=0)
+    cols = np.arange(y.shape[1])
+    rmse = np.sqrt(sse[best, cols] / max(len(y) - 1, 1))
+    return level[best, cols], a[best, 0], rmse
+
+
+def _fit_task(y):
+    return fit_exponential_smoothing(y)
+
+
+def forecast(demand, as_of, horizon_days=HORIZON_DAYS, workers=1):
+    # Fits every series (split into one task per worker across a process pool
+    # when workers > 1) and returns one row per series and future day with the
+    # flat SES forecast
+    columns = [name for name, _ in TABLE["columns"]]
+    if demand.empty or not demand.shape[1]:
+        return pd.DataFrame(columns=columns)
+    y = demand.to_numpy()
+    tasks = np.array_split(y, min(workers, y.shape[1]), axis=1)
+    if len(tasks) > 1:
+        with ProcessPoolExecutor(len(tasks)) as executor:
+            results = list(executor.map(_fit_task, tasks))
+    else:
+        results = [_fit_task(task) for task in tasks]
+    level, alpha, rmse = (np.concatenate(parts) for parts in zip(*results))
+
+    series = demand.columns.to_frame(index=False)
+    dates = pd.date_range(as_of + pd.Timedelta(days=1), periods=horizon_days, freq="D")
+    n = len(series)
+    frame = pd.DataFrame({
+        "date": np.repeat(dates.to_numpy(), n),
+        **{key: np.tile(series[key].to_numpy(), horizon_days) for key in SERIES_KEYS},
+        "forecast_units": np.tile(level, horizon_days),
+        "alpha": np.tile(alpha, horizon_days),
+        "rmse": np.tile(rmse, horizon_days),
+    })
+    return frame[columns]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Forecast daily demand per hospital, blood type and component.")
+    parser.add_argument("--as-of", type=pd.Timestamp, default=None,
+                        help="fit on history up to this date, YYYY-MM-DD (default: today)")
+    parser.add_argument("--horizon-days", type=int, default=HORIZON_DAYS,
+                        help=f"days ahead to forecast (default {HORIZON_DAYS})")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="fit series across this many processes")
+    args = parser.parse_args(argv)
+    if args.horizon_days <= 0:
+        parser.error("--horizon-days must be positive")
+    if args.workers <= 0:
+        parser.error("--workers must be positive")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    as_of = (args.as_of or pd.Timestamp.today()).normalize()
+
+    conn = sqlite3.connect(db_path)
+    with etl_loader.stage_run(conn, "demand_forecast") as run:
+        demand = read_demand(conn, as_of)
+        started = time.perf_counter()
+        forecasts = forecast(demand, as_of, args.horizon_days, args.workers)
+        print(f"Fitted {demand.shape[1]} series over {len(demand)} days in {time.perf_counter() - started:.2f}s")
+        etl_loader.write_aggregate(conn, "demand_forecast", TABLE, forecasts)
+        run.update(rows=len(forecasts), changed=["demand_forecast"])
+    conn.close()
+    print(f"{len(forecasts)} forecast rows written to {db_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+# Blood bank domain constants shared by the generator and the stages, kept free
+# of imports so any module can use them without loading the others
+
+LOCATIONS = ["center_1", "center_2", "mobile_drive_1"]
+BLOOD_TYPES = ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]
+COMPONENTS = ["plasma", "platelets", "whole_blood"]
+# expiry: plasma 42 days, platelets 5 days, whole_blood 35 days
+SHELF_LIFE_DAYS = {"plasma": 42, "platelets": 5, "whole_blood": 35}
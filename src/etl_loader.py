@@ -1,6 +1,19 @@
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
 import sqlite3
+import argparse
+import hashlib
+import time
 import os
+from contextlib import contextmanager
+from datetime import date
+
+import storage
+from domain import SHELF_LIFE_DAYS
+from instrument import StageRecorder, profiled
+from inventory_engine import allocations_from_requests, has_table
 
 # --- Paths ---
 current_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
@@ -10,20 +23,957 @@ os.makedirs(data_dir, exist_ok=True)
 
 db_path = os.path.join(project_root, "blood_inventory.db")
 
-# Load CSVs
-donors_df = pd.read_csv(os.path.join(data_dir, "donors.csv"), parse_dates=["dob"])
-donations_df = pd.read_csv(os.path.join(data_dir, "donations.csv"), parse_dates=["donation_date","expiry_date"])
-requests_df = pd.read_csv(os.path.join(data_dir, "hospital_requests.csv"), parse_dates=["request_date","fulfilled_date"])
-inventory_df = pd.read_csv(os.path.join(data_dir, "inventory.csv"), parse_dates=["last_updated"])
+# table -> (csv file, date columns, key column, high-water-mark column)
+TABLES = {
+    "donors": ("donors.csv", ["dob"], "donor_id", None),
+    "donations": ("donations.csv", ["donation_date", "expiry_date"], "donation_id", "donation_date"),
+    "hospital_requests": ("hospital_requests.csv", ["request_date", "fulfilled_date"], "request_id", "request_date"),
+    "inventory": ("inventory.csv", ["last_updated"], "inventory_id", None),
+}
+# --- Schema ---
+# Dates are stored as ISO-8601 DATE text (YYYY-MM-DD) so they sort and index correctly
+SCHEMA = {
+    "donors": [
+        ("donor_id", "TEXT PRIMARY KEY"),
+        ("dob", "DATE"),
+        ("blood_type", "TEXT NOT NULL"),
+    ],
+    "donations": [
+        ("donation_id", "TEXT PRIMARY KEY"),
+        ("donor_id", "TEXT"),
+        ("blood_type", "TEXT NOT NULL"),
+        ("component", "TEXT NOT NULL"),
+        ("units", "INTEGER NOT NULL"),
+        ("donation_date", "DATE NOT NULL"),
+        ("expiry_date", "DATE NOT NULL"),
+        ("location_id", "TEXT NOT NULL"),
+        ("qc_pass", "BOOLEAN NOT NULL CHECK (qc_pass IN (0, 1))"),
+    ],
+    "hospital_requests": [
+        ("request_id", "TEXT PRIMARY KEY"),
+        ("hospital_id", "TEXT"),
+        ("blood_type", "TEXT NOT NULL"),
+        ("component", "TEXT NOT NULL"),
+        ("units_requested", "INTEGER NOT NULL"),
+        ("request_date", "DATE NOT NULL"),
+        ("status", "TEXT NOT NULL"),
+        ("urgency", "TEXT"),
+        ("fulfilled_date", "DATE"),
+    ],
+    "inventory": [
+        ("inventory_id", "TEXT PRIMARY KEY"),
+        ("blood_type", "TEXT NOT NULL"),
+        ("component", "TEXT NOT NULL"),
+        ("units_available", "INTEGER NOT NULL"),
+        ("location_id", "TEXT NOT NULL"),
+        ("last_updated", "DATE"),
+        ("notes", "TEXT"),
+    ],
+    # Lot-level assignments written by allocation.py (not loaded from files)
+    "allocations": [
+        ("request_id", "TEXT NOT NULL"),
+        ("donation_id", "TEXT NOT NULL"),
+        ("blood_type", "TEXT NOT NULL"),
+        ("component", "TEXT NOT NULL"),
+        ("location_id", "TEXT NOT NULL"),
+        ("units", "INTEGER NOT NULL"),
+        ("allocated_date", "DATE NOT NULL"),
+        ("expiry_date", "DATE NOT NULL"),
+    ],
+}
+# index name -> (table, columns); built after the rows are written
+INDEXES = {
+    "idx_donors_blood_type": ("donors", "blood_type"),
+    "idx_donations_type_component_location": ("donations", "blood_type, component, location_id"),
+    "idx_donations_donation_date": ("donations", "donation_date"),
+    "idx_donations_expiry_date": ("donations", "expiry_date"),
+    "idx_requests_type_component": ("hospital_requests", "blood_type, component"),
+    "idx_requests_request_date": ("hospital_requests", "request_date"),
+    "idx_requests_status": ("hospital_requests", "status"),
+    "idx_inventory_type_component_location": ("inventory", "blood_type, component, location_id"),
+    "idx_allocations_request": ("allocations", "request_id"),
+    "idx_allocations_donation": ("allocations", "donation_id"),
+}
+# --- Materialized aggregates ---
+# Daily rollups are refreshed per touched date on incremental loads; the
+# small derived tables are rebuilt from the rollups and inventory every run.
+ROLLUPS = {
+    "daily_donations": {
+        "primary_key": "donation_date, blood_type, component, location_id",
+        "source": "donations",
+        "date_column": "donation_date",
+        "columns": [
+            ("donation_date", "DATE NOT NULL"),
+            ("blood_type", "TEXT NOT NULL"),
+            ("component", "TEXT NOT NULL"),
+            ("location_id", "TEXT NOT NULL"),
+            ("units", "INTEGER NOT NULL"),
+            ("donations", "INTEGER NOT NULL"),
+        ],
+        "select": """
+            SELECT donation_date, blood_type, component, location_id, SUM(units), COUNT(*)
+            FROM donations {where}
+            GROUP BY donation_date, blood_type, component, location_id
+        """,
+    },
+    "daily_requests": {
+        "primary_key": "date, blood_type, component, status",
+        "source": "hospital_requests",
+        "date_column": "request_date",
+        "columns": [
+            ("date", "DATE NOT NULL"),
+            ("blood_type", "TEXT NOT NULL"),
+            ("component", "TEXT NOT NULL"),
+            ("status", "TEXT NOT NULL"),
+            ("units_requested", "INTEGER NOT NULL"),
+            ("requests", "INTEGER NOT NULL"),
+        ],
+        "select": """
+            SELECT request_date, blood_type, component, status, SUM(units_requested), COUNT(*)
+            FROM hospital_requests {where}
+            GROUP BY request_date, blood_type, component, status
+        """,
+    },
+}
+# Live units available per key as of the run's date: QC-passed, unexpired
+# donations minus what was allocated from them, the level inventory_engine
+# gives for that date. The inventory table is the generator's snapshot at
+# generation time and ages with every run, so it is not used. Only lots live on
+# :as_of are read (through idx_donations_expiry_date), so the cost follows the
+# stock on hand rather than the donation history. Built before DERIVED reads it.
+STOCK_BY_TYPE = {
+    "primary_key": "blood_type, component, location_id",
+    "columns": [
+        ("blood_type", "TEXT NOT NULL"),
+        ("component", "TEXT NOT NULL"),
+        ("location_id", "TEXT NOT NULL"),
+        ("units_available", "INTEGER NOT NULL"),
+    ],
+    # {charged}: units already taken from each live lot, by donation_id. The
+    # unary + stops SQLite from scanning every donation through the key index
+    # just to skip sorting the groups.
+    "select": """
+        SELECT d.blood_type, d.component, d.location_id, SUM(MAX(d.units - COALESCE(c.units, 0), 0)) AS units_available
+        FROM donations d
+        LEFT JOIN ({charged}) c USING (donation_id)
+        WHERE d.qc_pass = 1 AND d.donation_date <= :as_of AND d.expiry_date >= :as_of
+        GROUP BY +d.blood_type, d.component, d.location_id
+        HAVING units_available > 0
+    """,
+    "charged": """
+        SELECT a.donation_id, SUM(a.units) AS units
+        FROM allocations a
+        JOIN donations d USING (donation_id)
+        WHERE d.expiry_date >= :as_of AND a.allocated_date <= :as_of
+        GROUP BY a.donation_id
+    """,
+}
+# Without an allocations table, fulfilled requests are matched to lots by
+# inventory_engine's first-expired-first-out fallback. Only requests fulfilled
+# within the longest shelf life before as_of can have drawn on a lot that is
+# still live, so only they and the lots they could have drawn on are replayed.
+# Requests fulfilled earlier are ignored, so lots they would have used first
+# may be charged slightly late; the figure is an estimate until allocation.py runs.
+FALLBACK_WINDOW_DAYS = max(SHELF_LIFE_DAYS.values())
+DERIVED = {
+    "donations_30d": {
+        "primary_key": "blood_type, component",
+        "columns": [
+            ("blood_type", "TEXT NOT NULL"),
+            ("component", "TEXT NOT NULL"),
+            ("donated_units_30d", "INTEGER NOT NULL"),
+        ],
+        # :as_of is bound to today's date; the window is the 30 days ending on it
+        "select": """
+            SELECT blood_type, component, SUM(units)
+            FROM daily_donations
+            WHERE donation_date > date(:as_of, '-30 days') AND donation_date <= :as_of
+            GROUP BY blood_type, component
+        """,
+    },
+    "days_of_supply": {
+        "primary_key": "blood_type, component, location_id",
+        "columns": [
+            ("blood_type", "TEXT NOT NULL"),
+            ("component", "TEXT NOT NULL"),
+            ("location_id", "TEXT NOT NULL"),
+            ("units_available", "INTEGER NOT NULL"),
+            ("avg_daily_demand", "REAL NOT NULL"),
+            ("days_of_supply", "REAL"),
+            ("alert", "TEXT NOT NULL"),
+        ],
+        # Average daily units requested over the :window_days ending on :as_of.
+        # Requests carry no location, so each location takes the share of its
+        # type's demand that matches its share of the type's recent collections,
+        # smoothed by one unit per location: a type with no recent collections
+        # splits its demand evenly, and stock where nothing was collected still
+        # gets some demand. Every known location gets a row for every type in
+        # demand, so a stock-out shows up as 0 days. days_of_supply is NULL when
+        # there is no demand; alert levels come from supply_thresholds.
+        "select": """
+            WITH demand AS (
+                SELECT blood_type, component, 1.0 * SUM(units_requested) / :window_days AS per_day
+                FROM daily_requests
+                WHERE date > date(:as_of, '-' || :window_days || ' days') AND date <= :as_of
+                GROUP BY blood_type, component
+            ),
+            intake AS (
+                SELECT blood_type, component, location_id, SUM(units) AS units
+                FROM daily_donations
+                WHERE donation_date > date(:as_of, '-' || :window_days || ' days') AND donation_date <= :as_of
+                GROUP BY blood_type, component, location_id
+            ),
+            locations AS (
+                SELECT location_id FROM stock_by_type
+                UNION
+                SELECT location_id FROM daily_donations
+            ),
+            keyed AS (
+                SELECT blood_type, component, location_id FROM stock_by_type
+                UNION
+                SELECT blood_type, component, location_id FROM intake
+                UNION
+                SELECT d.blood_type, d.component, l.location_id FROM demand d CROSS JOIN locations l
+            ),
+            located AS (
+                SELECT k.blood_type, k.component, k.location_id,
+                       COALESCE(s.units_available, 0) AS units_available,
+                       COALESCE(d.per_day, 0) * (COALESCE(i.units, 0) + 1.0)
+                           / (SUM(COALESCE(i.units, 0)) OVER type_key + COUNT(*) OVER type_key) AS avg_daily_demand
+                FROM keyed k
+                LEFT JOIN stock_by_type s USING (blood_type, component, location_id)
+                LEFT JOIN intake i USING (blood_type, component, location_id)
+                LEFT JOIN demand d USING (blood_type, component)
+                WINDOW type_key AS (PARTITION BY k.blood_type, k.component)
+            )
+            SELECT l.blood_type, l.component, l.location_id, l.units_available, l.avg_daily_demand,
+                   CASE WHEN l.avg_daily_demand > 0 THEN l.units_available / l.avg_daily_demand END,
+                   CASE
+                       WHEN l.avg_daily_demand = 0 THEN 'ok'
+                       WHEN l.units_available / l.avg_daily_demand < t.critical_days THEN 'critical'
+                       WHEN l.units_available / l.avg_daily_demand < t.low_days THEN 'low'
+                       ELSE 'ok'
+                   END
+            FROM located l
+            JOIN supply_thresholds t USING (component)
+        """,
+    },
+}
+# Trailing window, in days, of the average daily demand behind days_of_supply
+DEMAND_WINDOW_DAYS = 28
+# component -> (critical, low) days-of-supply alert thresholds that seed the
+# supply_thresholds table; short-lived platelets are never held for long, so
+# their thresholds are lower. Other components use DEFAULT_SUPPLY_THRESHOLDS.
+SUPPLY_THRESHOLDS = {"platelets": (1.0, 2.0), "plasma": (3.0, 7.0), "whole_blood": (3.0, 7.0)}
+DEFAULT_SUPPLY_THRESHOLDS = (3.0, 7.0)
+SUPPLY_THRESHOLDS_TABLE = {
+    "primary_key": "component",
+    "columns": [
+        ("component", "TEXT NOT NULL"),
+        ("critical_days", "REAL NOT NULL"),
+        ("low_days", "REAL NOT NULL"),
+    ],
+}
+# Tables that are regenerated as a whole snapshot and are always replaced
+SNAPSHOT_TABLES = {"inventory"}
+# allocations points at donation and request ids; a full reload of either table
+# may reuse those ids for different rows, so the assignments are dropped
+ALLOCATION_SOURCES = ("donations", "hospital_requests")
+# Rows per executemany batch in the bulk writer (all batches share one transaction)
+BULK_BATCH_ROWS = 100_000
+# Connection settings while loading: WAL so dashboard readers are not blocked,
+# no fsync per commit, and a ~256 MB page cache
+LOAD_PRAGMAS = {"journal_mode": "WAL", "synchronous": "OFF", "cache_size": -262144, "temp_store": "MEMORY"}
+# Read size when hashing the CSV prefix that must be unchanged for a CSV to count as appended-to
+FINGERPRINT_CHUNK_BYTES = 1 << 20
+
+
+# --- Load state ---
+def ensure_state_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS etl_state (
+            table_name TEXT PRIMARY KEY,
+            file_offset INTEGER NOT NULL,
+            fingerprint TEXT NOT NULL,
+            high_water_mark TEXT,
+            rows_loaded INTEGER NOT NULL,
+            loaded_at TEXT NOT NULL
+        )
+    """)
+
+
+def ensure_run_tables(conn):
+    # etl_runs has one row per ETL run; table_versions records the run that last
+    # changed each table, so readers can tell cheaply whether their inputs changed
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS etl_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            mode TEXT NOT NULL,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            rows_loaded INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            run_id INTEGER NOT NULL
+        )
+    """)
+    # etl_run_stages has one row per instrumented stage of a run (see instrument.StageRecorder)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS etl_run_stages (
+            run_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            stage TEXT NOT NULL,
+            table_name TEXT,
+            started_at TEXT NOT NULL,
+            wall_s REAL NOT NULL,
+            cpu_s REAL NOT NULL,
+            rows INTEGER,
+            bytes_read INTEGER,
+            peak_rss_mb REAL,
+            PRIMARY KEY (run_id, seq)
+        )
+    """)
+
+
+def record_stages(conn, run_id, records):
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO etl_run_stages
+            (run_id, seq, stage, table_name, started_at, wall_s, cpu_s, rows, bytes_read, peak_rss_mb)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        ((run_id, seq, r["stage"], r["table"], r["started_at"], r["wall_s"], r["cpu_s"],
+          r["rows"], r["bytes_read"], r["peak_rss_mb"]) for seq, r in enumerate(records)),
+    )
+
+
+def start_run(conn, mode):
+    cur = conn.execute("INSERT INTO etl_runs (mode, started_at) VALUES (?, datetime('now'))", (mode,))
+    return cur.lastrowid
+
+
+def finish_run(conn, run_id, rows_loaded, changed_tables):
+    conn.execute(
+        "UPDATE etl_runs SET finished_at = datetime('now'), rows_loaded = ? WHERE run_id = ?",
+        (rows_loaded, run_id),
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO table_versions (table_name, run_id) VALUES (?, ?)",
+        ((table, run_id) for table in changed_tables),
+    )
+
+
+@contextmanager
+def stage_run(conn, mode, backend=None):
+    # Runs a stage that writes the database outside the ETL (allocation, wastage,
+    # forecasts, data_gen's SQLite sink) as an ETL run of its own. The body fills
+    # in the yielded run's "rows" and "changed" tables and writes them in one
+    # transaction; on success the run is finished, committed and its changed
+    # tables published to backend (default: storage.open_storage()).
+    ensure_run_tables(conn)
+    run = {"run_id": start_run(conn, mode), "rows": 0, "changed": []}
+    conn.commit()
+    apply_load_pragmas(conn)
+    conn.execute("BEGIN")
+    try:
+        yield run
+        finish_run(conn, run["run_id"], run["rows"], run["changed"])
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.execute("PRAGMA synchronous = NORMAL")
+    (backend or storage.open_storage()).publish(conn, run["changed"])
+
+
+def ensure_files_table(conn):
+    # Parquet part files already loaded, so incremental runs only read new or changed ones
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS etl_files (
+            table_name TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            PRIMARY KEY (table_name, path)
+        )
+    """)
+
+
+def get_files(conn, table):
+    rows = conn.execute("SELECT path, size, mtime_ns FROM etl_files WHERE table_name = ?", (table,))
+    return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+
+def record_files(conn, table, files, replace):
+    if replace:
+        conn.execute("DELETE FROM etl_files WHERE table_name = ?", (table,))
+    conn.executemany(
+        "INSERT OR REPLACE INTO etl_files (table_name, path, size, mtime_ns) VALUES (?, ?, ?, ?)",
+        ((table, path, size, mtime_ns) for path, (size, mtime_ns) in files.items()),
+    )
+
+
+def get_state(conn, table):
+    return conn.execute(
+        "SELECT file_offset, fingerprint, high_water_mark FROM etl_state WHERE table_name = ?", (table,)
+    ).fetchone()
+
+
+def set_state(conn, table, offset, fingerprint, high_water_mark, rows_loaded):
+    conn.execute(
+        """
+        INSERT INTO etl_state (table_name, file_offset, fingerprint, high_water_mark, rows_loaded, loaded_at)
+        VALUES (?, ?, ?, ?, ?, datetime('now'))
+        ON CONFLICT(table_name) DO UPDATE SET
+            file_offset = excluded.file_offset,
+            fingerprint = excluded.fingerprint,
+            high_water_mark = excluded.high_water_mark,
+            rows_loaded = excluded.rows_loaded,
+            loaded_at = excluded.loaded_at
+        """,
+        (table, offset, fingerprint, high_water_mark, rows_loaded),
+    )
+
+
+def hash_bytes(digest, path, start, end):
+    # Feeds bytes [start, end) of the file to digest in chunks and returns it
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(FINGERPRINT_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest
+
+
+def file_fingerprint(path, offset):
+    # Hash of the first `offset` bytes, so any edit to rows already loaded changes
+    # it. A sequential read with no parsing, cheap next to reading the rows.
+    return hash_bytes(hashlib.sha1(), path, 0, offset).hexdigest()
+
+
+def high_water_mark(df, column):
+    if column is None or df.empty or df[column].isna().all():
+        return None
+    return str(pd.Timestamp(df[column].max()).date())
+
+
+# --- Readers ---
+def schema_columns(table):
+    # Column projection for the CSV parser: columns outside the schema are never parsed
+    names = {name for name, _ in SCHEMA[table]}
+    return lambda column: column in names
+
+
+def parse_dates(table, df, recorder):
+    # Date columns arrive as text from the CSV reader (Parquet frames are already
+    # typed); parsing them is timed as its own stage
+    with recorder.stage("parse_dates", table) as stage:
+        for col in TABLES[table][1]:
+            if col in df:
+                df[col] = pd.to_datetime(df[col])
+        stage["rows"] = len(df)
+    return df
+
+
+def read_table(table, recorder=None):
+    recorder = recorder or StageRecorder()
+    path = os.path.join(data_dir, TABLES[table][0])
+    with recorder.stage("read", table) as stage:
+        df = pd.read_csv(path, usecols=schema_columns(table))
+        size = os.path.getsize(path)
+        stage.update(rows=len(df), bytes_read=size)
+    return parse_dates(table, df, recorder), size
+
+
+def read_appended(table, offset, recorder=None):
+    # Rows appended to the CSV after `offset`; the header is re-read for column names
+    recorder = recorder or StageRecorder()
+    path = os.path.join(data_dir, TABLES[table][0])
+    with recorder.stage("read", table) as stage:
+        columns = pd.read_csv(path, nrows=0).columns
+        with open(path, "rb") as f:
+            f.seek(offset)
+            df = pd.read_csv(f, header=None, names=columns, usecols=schema_columns(table))
+        size = os.path.getsize(path)
+        stage.update(rows=len(df), bytes_read=size - offset)
+    return parse_dates(table, df, recorder), size
+
+
+def parquet_files(table):
+    # relative path -> (size, mtime_ns) for every part file of data/<table>/
+    root = os.path.join(data_dir, table)
+    files = {}
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            if name.endswith(".parquet"):
+                path = os.path.join(dirpath, name)
+                stat = os.stat(path)
+                files[os.path.relpath(path, root)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def files_fingerprint(files):
+    listing = "\n".join(f"{path}:{size}:{mtime}" for path, (size, mtime) in sorted(files.items()))
+    return "parquet:" + hashlib.sha1(listing.encode()).hexdigest()
+
+
+def read_parquet(table, paths, recorder=None):
+    # Only the schema's columns are read, and the frame stays backed by the Arrow
+    # buffers (ArrowDtype) instead of being converted to numpy/object columns.
+    # paths: relative path -> (size, mtime_ns), as from parquet_files
+    recorder = recorder or StageRecorder()
+    root = os.path.join(data_dir, table)
+    if not paths:
+        raise FileNotFoundError(f"no Parquet files under {root}/; run data_gen.py --sink parquet")
+    with recorder.stage("read", table) as stage:
+        dataset = ds.dataset([os.path.join(root, p) for p in sorted(paths)], format="parquet")
+        columns = [name for name, _ in SCHEMA[table] if name in dataset.schema.names]
+        df = dataset.to_table(columns=columns).to_pandas(types_mapper=pd.ArrowDtype)
+        stage.update(rows=len(df), bytes_read=sum(size for size, _ in paths.values()))
+    return df
+
+
+# --- Writers ---
+def table_ddl(table):
+    columns = ",\n    ".join(f"{name} {decl}" for name, decl in SCHEMA[table])
+    return f"CREATE TABLE {table} (\n    {columns}\n)"
+
+
+def create_table(conn, table):
+    conn.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.execute(table_ddl(table))
+
+
+def create_indexes(conn, table):
+    for name, (index_table, columns) in INDEXES.items():
+        if index_table == table:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def schema_matches(conn, table):
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None and row[0] == table_ddl(table)
+
+
+def prepare_frame(table, df):
+    # Keep the schema's columns in order (extra CSV columns are dropped) and
+    # turn dates into DATE text with None for missing values
+    df = df[[name for name, _ in SCHEMA[table]]].copy()
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.ArrowDtype) and pa.types.is_date(dtype.pyarrow_dtype):
+            df[col] = df[col].astype(pd.ArrowDtype(pa.string()))
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            text = np.datetime_as_string(df[col].to_numpy(), unit="D").astype(object)
+            text[df[col].isna().to_numpy()] = None
+            df[col] = text
+    return df
+
+
+def column_values(series):
+    # Plain Python values with None for missing; going through numpy is much
+    # faster than tolist() for Arrow-backed columns
+    values = series.to_numpy().tolist()
+    if series.hasnans:
+        values = [None if missing else v for v, missing in zip(values, series.isna().tolist())]
+    return values
+
+
+def iter_batches(df, batch_rows=BULK_BATCH_ROWS):
+    for start in range(0, len(df), batch_rows):
+        batch = df.iloc[start:start + batch_rows]
+        yield zip(*(column_values(batch[col]) for col in batch.columns))
+
+
+def bulk_insert(conn, table, df):
+    # Later rows win over earlier ones with the same primary key
+    columns = ", ".join(df.columns)
+    placeholders = ", ".join("?" * len(df.columns))
+    sql = f"INSERT OR REPLACE INTO {table} ({columns}) VALUES ({placeholders})"
+    for rows in iter_batches(df):
+        conn.executemany(sql, rows)
+
+
+def insert_or_replace(pd_table, conn, keys, data_iter):
+    # DataFrame.to_sql insertion method that replaces rows whose primary key exists
+    placeholders = ", ".join("?" * len(keys))
+    conn.executemany(f"INSERT OR REPLACE INTO {pd_table.name} ({', '.join(keys)}) VALUES ({placeholders})", list(data_iter))
+
+
+def replace_table(conn, table, df, bulk, recorder=None):
+    recorder = recorder or StageRecorder()
+    with recorder.stage("write", table) as stage:
+        df = prepare_frame(table, df)
+        create_table(conn, table)
+        if bulk:
+            bulk_insert(conn, table, df)
+        else:
+            key = TABLES[table][2]
+            df = df.drop_duplicates(subset=key, keep="last")
+            df.to_sql(table, conn, if_exists="append", index=False)
+        stage["rows"] = len(df)
+    with recorder.stage("indexes", table):
+        create_indexes(conn, table)
+
+
+def upsert_rows(conn, table, df, bulk, recorder=None):
+    # Rows whose key already exists are replaced by the incoming version.
+    # Returns the dates (old and new) whose daily rollups the change touches.
+    recorder = recorder or StageRecorder()
+    with recorder.stage("write", table) as stage:
+        stage["rows"] = len(df)
+        return _upsert_rows(conn, table, df, bulk)
+
+
+def _upsert_rows(conn, table, df, bulk):
+    df = prepare_frame(table, df)
+    key, date_column = TABLES[table][2], TABLES[table][3]
+    touched = set()
+    if date_column is not None:
+        touched.update(df[date_column].dropna())
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS etl_incoming_keys (key TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM etl_incoming_keys")
+        conn.executemany("INSERT OR IGNORE INTO etl_incoming_keys VALUES (?)", ((k,) for k in df[key].astype(str)))
+        touched.update(d for (d,) in conn.execute(
+            f"SELECT DISTINCT {date_column} FROM {table} WHERE {key} IN (SELECT key FROM etl_incoming_keys)"
+        ))
+    if bulk:
+        bulk_insert(conn, table, df)
+    else:
+        df = df.drop_duplicates(subset=key, keep="last")
+        df.to_sql(table, conn, if_exists="append", index=False, method=insert_or_replace)
+    return touched
+
+
+# --- Aggregates ---
+def aggregate_ddl(name, spec):
+    columns = ",\n    ".join(f"{col} {decl}" for col, decl in spec["columns"])
+    return f"CREATE TABLE {name} (\n    {columns},\n    PRIMARY KEY ({spec['primary_key']})\n)"
+
+
+def ensure_aggregate(conn, name, spec):
+    # (Re)creates the table if missing or its DDL changed; returns True if it did
+    ddl = aggregate_ddl(name, spec)
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    if row is not None and row[0] == ddl:
+        return False
+    conn.execute(f"DROP TABLE IF EXISTS {name}")
+    conn.execute(ddl)
+    return True
+
+
+def write_aggregate(conn, name, spec, df):
+    # Replaces the contents of a stage-owned table (wastage, forecasts) with df,
+    # whose columns follow spec["columns"]
+    ensure_aggregate(conn, name, spec)
+    conn.execute(f"DELETE FROM {name}")
+    df = df[[col for col, _ in spec["columns"]]].copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col].dtype):
+            text = np.datetime_as_string(df[col].to_numpy(), unit="D").astype(object)
+            text[df[col].isna().to_numpy()] = None
+            df[col] = text
+    bulk_insert(conn, name, df)
+
+
+def refresh_rollup(conn, name, dates=None):
+    # dates=None rebuilds the whole rollup, otherwise only those dates are recomputed
+    spec = ROLLUPS[name]
+    if dates is None:
+        conn.execute(f"DELETE FROM {name}")
+        conn.execute(f"INSERT INTO {name} " + spec["select"].format(where=""))
+        return
+    if not dates:
+        return
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS etl_touched_dates (date TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM etl_touched_dates")
+    conn.executemany("INSERT INTO etl_touched_dates VALUES (?)", ((d,) for d in dates))
+    rollup_date = spec["columns"][0][0]
+    conn.execute(f"DELETE FROM {name} WHERE {rollup_date} IN (SELECT date FROM etl_touched_dates)")
+    where = f"WHERE {spec['date_column']} IN (SELECT date FROM etl_touched_dates)"
+    conn.execute(f"INSERT INTO {name} " + spec["select"].format(where=where))
+
+
+def write_supply_thresholds(conn, thresholds=None):
+    # supply_thresholds persists between runs so it can be edited per component:
+    # components without a row get SUPPLY_THRESHOLDS (or the default), and
+    # thresholds=(critical_days, low_days) overrides every component.
+    # Returns True if any row changed.
+    ensure_aggregate(conn, "supply_thresholds", SUPPLY_THRESHOLDS_TABLE)
+    before = conn.total_changes
+    components = {c for (c,) in conn.execute(
+        "SELECT component FROM daily_donations UNION SELECT component FROM daily_requests")}
+    components.update(SUPPLY_THRESHOLDS)
+    conn.executemany(
+        "INSERT OR IGNORE INTO supply_thresholds (component, critical_days, low_days) VALUES (?, ?, ?)",
+        ((c, *SUPPLY_THRESHOLDS.get(c, DEFAULT_SUPPLY_THRESHOLDS)) for c in sorted(components)),
+    )
+    if thresholds is not None:
+        conn.execute("UPDATE supply_thresholds SET critical_days = ?, low_days = ?", thresholds)
+    return conn.total_changes != before
+
+
+def fallback_charges(conn, as_of):
+    # (donation_id, units) charged to live lots by the fulfilled requests of the
+    # FALLBACK_WINDOW_DAYS before as_of, as a temporary table for STOCK_BY_TYPE.
+    # Requests only draw on their own blood type and component, so each pair is
+    # replayed on its own and memory stays bounded by the largest pair's lots.
+    since = (pd.Timestamp(as_of) - pd.Timedelta(days=FALLBACK_WINDOW_DAYS)).date().isoformat()
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS etl_fallback_charges (donation_id TEXT PRIMARY KEY, units INTEGER)")
+    conn.execute("DELETE FROM etl_fallback_charges")
+    pairs = conn.execute("""
+        SELECT DISTINCT blood_type, component
+        FROM hospital_requests
+        WHERE status = 'fulfilled' AND fulfilled_date > ? AND fulfilled_date <= ?
+    """, (since, as_of)).fetchall()
+    for blood_type, component in pairs:
+        lots = pd.read_sql("""
+            SELECT donation_id, blood_type, component, location_id, units, donation_date, expiry_date
+            FROM donations
+            WHERE blood_type = ? AND component = ? AND qc_pass = 1 AND expiry_date >= ? AND donation_date <= ?
+        """, conn, params=(blood_type, component, since, as_of), parse_dates=["donation_date", "expiry_date"])
+        requests = pd.read_sql("""
+            SELECT blood_type, component, units_requested, status, fulfilled_date
+            FROM hospital_requests
+            WHERE blood_type = ? AND component = ? AND status = 'fulfilled' AND fulfilled_date > ? AND fulfilled_date <= ?
+        """, conn, params=(blood_type, component, since, as_of), parse_dates=["fulfilled_date"])
+        allocations = allocations_from_requests(requests, lots)
+        live = allocations[allocations["expiry_date"] >= pd.Timestamp(as_of)]
+        charged = live.groupby("donation_id", as_index=False)["units"].sum()
+        conn.executemany("INSERT INTO etl_fallback_charges VALUES (?, ?)",
+                         zip(charged["donation_id"].tolist(), charged["units"].tolist()))
+    return "SELECT donation_id, units FROM etl_fallback_charges"
+
+
+def refresh_stock(conn, as_of):
+    # Rebuilds stock_by_type as of as_of (see STOCK_BY_TYPE)
+    ensure_aggregate(conn, "stock_by_type", STOCK_BY_TYPE)
+    if has_table(conn, "allocations"):
+        charged = STOCK_BY_TYPE["charged"]
+    else:
+        charged = fallback_charges(conn, as_of)
+    conn.execute("DELETE FROM stock_by_type")
+    conn.execute("INSERT INTO stock_by_type " + STOCK_BY_TYPE["select"].format(charged=charged), {"as_of": as_of})
+
+
+def refresh_aggregates(conn, touched, as_of, thresholds=None):
+    # touched: source table -> None (fully reloaded) or the set of dates it changed.
+    # Returns the aggregate tables whose contents may have changed.
+    changed = []
+    for name, spec in ROLLUPS.items():
+        dates = touched.get(spec["source"], set())
+        if ensure_aggregate(conn, name, spec):
+            dates = None
+        refresh_rollup(conn, name, dates)
+        if dates is None or dates:
+            changed.append(name)
+    if write_supply_thresholds(conn, thresholds):
+        changed.append("supply_thresholds")
+    refresh_stock(conn, as_of)
+    changed.append("stock_by_type")
+    params = {"as_of": as_of, "window_days": DEMAND_WINDOW_DAYS}
+    for name, spec in DERIVED.items():
+        ensure_aggregate(conn, name, spec)
+        conn.execute(f"DELETE FROM {name}")
+        conn.execute(f"INSERT INTO {name} {spec['select']}", params)
+        changed.append(name)
+    return changed
+
+
+def drop_allocations(conn):
+    # Readers fall back to their no-allocations path until allocation.py runs
+    # again. Returns True if there was a table to drop.
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'allocations'").fetchone()
+    if exists:
+        conn.execute("DROP TABLE allocations")
+    return exists is not None
+
+
+def apply_load_pragmas(conn):
+    for name, value in LOAD_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+# --- Loads ---
+def load_full(conn, table, bulk, source, recorder=None):
+    if source == "parquet":
+        files = parquet_files(table)
+        df = read_parquet(table, files, recorder)
+        size, fingerprint = sum(size for size, _ in files.values()), files_fingerprint(files)
+        record_files(conn, table, files, replace=True)
+    else:
+        df, size = read_table(table, recorder)
+        fingerprint = file_fingerprint(os.path.join(data_dir, TABLES[table][0]), size)
+    replace_table(conn, table, df, bulk, recorder)
+    set_state(conn, table, size, fingerprint, high_water_mark(df, TABLES[table][3]), len(df))
+    return len(df), None
+
+
+def load_incremental(conn, table, bulk, source, recorder=None):
+    if source == "parquet":
+        return load_incremental_parquet(conn, table, bulk, recorder)
+    path = os.path.join(data_dir, TABLES[table][0])
+    size = os.path.getsize(path)
+    state = get_state(conn, table)
+    appended = (
+        state is not None
+        and table not in SNAPSHOT_TABLES
+        and schema_matches(conn, table)
+        and size >= state[0]
+    )
+    # Hash of the rows already loaded, extended below over the appended ones
+    prefix = hash_bytes(hashlib.sha1(), path, 0, state[0]) if appended else None
+    if not appended or prefix.hexdigest() != state[1]:
+        # First load, snapshot table, outdated schema, or the CSV was rewritten rather than appended to
+        return load_full(conn, table, bulk, source, recorder)
+    if size == state[0]:
+        return 0, set()
+
+    df, size = read_appended(table, state[0], recorder)
+    touched = upsert_rows(conn, table, df, bulk, recorder)
+    marks = [m for m in (state[2], high_water_mark(df, TABLES[table][3])) if m is not None]
+    fingerprint = hash_bytes(prefix, path, state[0], size).hexdigest()
+    set_state(conn, table, size, fingerprint, max(marks, default=None), len(df))
+    return len(df), touched
+
+
+def load_incremental_parquet(conn, table, bulk, recorder=None):
+    files = parquet_files(table)
+    loaded = get_files(conn, table)
+    state = get_state(conn, table)
+    appended = (
+        state is not None
+        and state[1].startswith("parquet:")
+        and table not in SNAPSHOT_TABLES
+        and schema_matches(conn, table)
+        and all(files.get(path) == meta for path, meta in loaded.items())
+    )
+    if not appended:
+        # First Parquet load, snapshot table, outdated schema, or part files were
+        # removed or rewritten (data_gen.py rewrites the whole dataset)
+        return load_full(conn, table, bulk, "parquet", recorder)
+    new_files = {path: meta for path, meta in files.items() if path not in loaded}
+    if not new_files:
+        return 0, set()
+
+    df = read_parquet(table, new_files, recorder)
+    touched = upsert_rows(conn, table, df, bulk, recorder)
+    record_files(conn, table, new_files, replace=False)
+    marks = [m for m in (state[2], high_water_mark(df, TABLES[table][3])) if m is not None]
+    size = sum(size for size, _ in files.values())
+    set_state(conn, table, size, files_fingerprint(files), max(marks, default=None), len(df))
+    return len(df), touched
+
+
+def rate(rows, seconds):
+    return f" in {seconds:.2f}s ({rows / seconds:,.0f} rows/s)" if seconds > 0 else ""
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load generated CSV or Parquet data into SQLite.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only load rows appended to each CSV (or new Parquet part files) since the last run")
+    parser.add_argument("--source", choices=["csv", "parquet"], default="csv",
+                        help="read data/<table>.csv (default) or the Parquet datasets in data/<table>/")
+    parser.add_argument("--writer", choices=["bulk", "pandas"], default="bulk",
+                        help="executemany in one transaction with load PRAGMAs (default) or DataFrame.to_sql")
+    parser.add_argument("--critical-days", type=float, default=None,
+                        help="days-of-supply below which stock is critical, for every component "
+                             "(default: keep the supply_thresholds table)")
+    parser.add_argument("--low-days", type=float, default=None,
+                        help="days-of-supply below which stock is low, for every component")
+    parser.add_argument("--backend", choices=list(storage.BACKENDS), default=None,
+                        help="storage the dashboard reads: sqlite, or also publish changed tables to a "
+                             "DuckDB replica (default: $BLOOD_STORAGE, else sqlite)")
+    parser.add_argument("--metrics", default=None,
+                        help="append one JSON line per stage (read, parse_dates, write, indexes, aggregates) to this file")
+    parser.add_argument("--profile", default=None,
+                        help="run under cProfile, dump the stats to this file and print the top functions")
+    args = parser.parse_args(argv)
+    if (args.critical_days is None) != (args.low_days is None):
+        parser.error("--critical-days and --low-days must be given together")
+    if args.critical_days is not None and not 0 <= args.critical_days <= args.low_days:
+        parser.error("--critical-days must be between 0 and --low-days")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with profiled(args.profile):
+        run(args)
+
+
+def run(args):
+    # Connect to SQLite
+    conn = sqlite3.connect(db_path)
+    ensure_state_table(conn)
+    ensure_run_tables(conn)
+    ensure_files_table(conn)
+    run_id = start_run(conn, "incremental" if args.incremental else "full")
+    conn.commit()
+    recorder = StageRecorder(args.metrics, run_id)
+    bulk = args.writer == "bulk"
+    if bulk:
+        apply_load_pragmas(conn)
+
+    # Write tables
+    load = load_incremental if args.incremental else load_full
+    started = time.perf_counter()
+    total_rows = 0
+    touched = {}
+    changed = []
+    if bulk:
+        # One transaction for the whole load; to_sql commits per table by itself
+        conn.execute("BEGIN")
+    for table in TABLES:
+        table_started = time.perf_counter()
+        rows, touched[table] = load(conn, table, bulk, args.source, recorder)
+        if not bulk:
+            conn.commit()
+        total_rows += rows
+        if rows or touched[table] is None:
+            changed.append(table)
+        print(f"{table}: {rows} rows loaded{rate(rows, time.perf_counter() - table_started)}")
+
+    if any(touched[table] is None for table in ALLOCATION_SOURCES) and drop_allocations(conn):
+        changed.append("allocations")
+        print("allocations: dropped after a full reload; run allocation.py again")
+
+    # Refresh materialized aggregates in the same transaction as the rows
+    thresholds = None if args.critical_days is None else (args.critical_days, args.low_days)
+    with recorder.stage("aggregates") as stage:
+        # rows: rows the refresh inserted, updated or deleted, as SQLite counts them
+        changes_before = conn.total_changes
+        refreshed = refresh_aggregates(conn, touched, date.today().isoformat(), thresholds)
+        stage["rows"] = conn.total_changes - changes_before
+    changed += refreshed
+    print(f"Aggregates refreshed in {stage['wall_s']:.2f}s")
+    record_stages(conn, run_id, recorder.records)
+    finish_run(conn, run_id, total_rows, changed)
+    conn.commit()
+    if bulk:
+        conn.execute("PRAGMA synchronous = NORMAL")
+    print(f"Loaded {total_rows} rows{rate(total_rows, time.perf_counter() - started)}")
+    if recorder.records:
+        print("Slowest stages:\n" + recorder.summary())
 
-# Connect to SQLite
-conn = sqlite3.connect(db_path)
+    backend = storage.open_storage(args.backend)
+    if backend.name != "sqlite":
+        publish_started = time.perf_counter()
+        published = backend.publish(conn, changed)
+        print(f"Published {len(published)} tables to {backend.name} in {time.perf_counter() - publish_started:.2f}s")
+    conn.close()
+    print(f"ETL complete. Data loaded into {db_path}")
 
-# Write tables
-donors_df.to_sql("donors", conn, if_exists="replace", index=False)
-donations_df.to_sql("donations", conn, if_exists="replace", index=False)
-requests_df.to_sql("hospital_requests", conn, if_exists="replace", index=False)
-inventory_df.to_sql("inventory", conn, if_exists="replace", index=False)
 
-conn.close()
-print(f"ETL complete. Data loaded into {db_path}")
+if __name__ == "__main__":
+    main()
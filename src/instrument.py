@@ -0,0 +1,107 @@
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# --- Peak memory ---
+# On Linux the peak RSS (VmHWM) can be reset, so each stage reports its own
+# peak; elsewhere ru_maxrss gives the process peak so far. Where neither is
+# available (Windows) the peak is None.
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def round_mb(mb):
+    return None if mb is None else round(mb, 1)
+
+
+def format_mb(mb, width):
+    # Right-aligned "<mb> MB", or "n/a" where the peak is unknown
+    return f"{'n/a':>{width + 3}}" if mb is None else f"{mb:>{width}.1f} MB"
+
+
+# Records wall time, CPU time and peak RSS of each stage, plus whatever the
+# stage fills in (rows, bytes_read). Stages are not nested, so each one's peak
+# RSS is its own. Records go to an optional JSON-lines file as they finish.
+class StageRecorder:
+    def __init__(self, jsonl_path=None, run_id=None):
+        self.jsonl_path = jsonl_path
+        self.run_id = run_id
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, table=None):
+        record = {"run_id": self.run_id, "stage": name, "table": table, "rows": None, "bytes_read": None}
+        reset_peak_rss()
+        started_at = datetime.now().isoformat(timespec="milliseconds")
+        started, cpu_started = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record.update({
+                "started_at": started_at,
+                "wall_s": time.perf_counter() - started,
+                "cpu_s": time.process_time() - cpu_started,
+                "peak_rss_mb": round_mb(peak_rss_mb()),
+            })
+            self.records.append(record)
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+
+    def summary(self, top=5):
+        # The slowest stages, one line each
+        slowest = sorted(self.records, key=lambda r: r["wall_s"], reverse=True)[:top]
+        return "\n".join(
+            f"  {r['stage']:<12}{r['table'] or '':<20}{r['wall_s']:>8.2f}s wall{r['cpu_s']:>8.2f}s cpu"
+            + format_mb(r["peak_rss_mb"], 9) for r in slowest
+        )
+
+
+@contextmanager
+def profiled(path=None, top=20):
+    # Opt-in cProfile around a block: stats are dumped to `path` (pstats format,
+    # readable by snakeviz/gprof2dot) and the top functions by cumulative time
+    # are printed. With path=None this does nothing, which also leaves the
+    # process free for an external sampler such as py-spy.
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+        print(out.getvalue())
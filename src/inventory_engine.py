@@ -0,0 +1,188 @@
+import pandas as pd
+import numpy as np
+import sqlite3
+import argparse
+import heapq
+import os
+
+# --- Paths ---
+current_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
+project_root = os.path.abspath(os.path.join(current_dir, ".."))
+db_path = os.path.join(project_root, "blood_inventory.db")
+
+KEYS = ["blood_type", "component", "location_id"]
+# Keys and day numbers are packed into one sorted int64 search array
+_DAY_BITS = 32
+_DAY_OFFSET = 1 << 31
+
+
+# Dates as whole days since the epoch, shared by the stages' vectorized code
+def day_numbers(values):
+    return pd.to_datetime(pd.Series(values)).to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+def day_number(value):
+    return np.datetime64(pd.Timestamp(value), "D").astype(np.int64)
+
+
+# Available units per (blood_type, component, location_id) at any date.
+# Stock is kept as signed events: a QC-passed lot adds its units on the donation
+# date and removes them the day after it expires; an allocation removes units on
+# its date and, when the lot's expiry is known, cancels that lot's later expiry
+# event. Events are sorted per key and prefix-summed once, so each as-of lookup
+# is a binary search.
+class InventoryEngine:
+    def __init__(self, keys, days, deltas):
+        keys = pd.DataFrame(keys, columns=KEYS).reset_index(drop=True)
+        if len(keys):
+            codes, uniques = pd.MultiIndex.from_frame(keys).factorize()
+            self.keys = pd.MultiIndex.from_tuples(list(uniques), names=KEYS)
+        else:
+            # No lots or allocations: pandas cannot infer the levels of an empty list
+            codes = np.array([], dtype=np.int64)
+            self.keys = pd.MultiIndex.from_arrays([[]] * len(KEYS), names=KEYS)
+        self._key_codes = {key: code for code, key in enumerate(self.keys)}
+
+        order = np.lexsort((days, codes))
+        codes, days, deltas = codes[order], np.asarray(days)[order], np.asarray(deltas)[order]
+        # Running level per key: global prefix sum minus the sum before the key's first event
+        level = np.cumsum(deltas)
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        before = np.r_[0, level[starts[1:] - 1]] if len(starts) else np.array([], dtype=level.dtype)
+        level = level - np.repeat(before, np.diff(np.r_[starts, len(codes)]))
+
+        self._search = (codes.astype(np.int64) << _DAY_BITS) + (days + _DAY_OFFSET)
+        self._codes = codes
+        self._level = level
+
+    @classmethod
+    def from_frames(cls, lots, allocations=None):
+        # lots: QC-passed donations with KEYS, units, donation_date, expiry_date.
+        # allocations: KEYS, units, allocated_date and optionally expiry_date of the source lot.
+        frames = []
+        lot_keys = lots[KEYS]
+        units = lots["units"].to_numpy(np.int64)
+        frames.append((lot_keys, day_numbers(lots["donation_date"]), units))
+        frames.append((lot_keys, day_numbers(lots["expiry_date"]) + 1, -units))
+
+        if allocations is not None and len(allocations):
+            alloc_keys = allocations[KEYS]
+            units = allocations["units"].to_numpy(np.int64)
+            frames.append((alloc_keys, day_numbers(allocations["allocated_date"]), -units))
+            if "expiry_date" in allocations:
+                known = allocations["expiry_date"].notna().to_numpy()
+                frames.append((alloc_keys[known], day_numbers(allocations["expiry_date"][known]) + 1, units[known]))
+
+        keys = pd.concat([k for k, _, _ in frames], ignore_index=True)
+        days = np.concatenate([d for _, d, _ in frames])
+        deltas = np.concatenate([u for _, _, u in frames])
+        return cls(keys, days, deltas)
+
+    def _levels(self, codes, as_of):
+        day = day_number(as_of)
+        probes = (codes.astype(np.int64) << _DAY_BITS) + (day + _DAY_OFFSET)
+        pos = np.searchsorted(self._search, probes, side="right") - 1
+        found = (pos >= 0) & (self._codes[np.maximum(pos, 0)] == codes)
+        return np.where(found, self._level[np.maximum(pos, 0)], 0)
+
+    def available(self, as_of, blood_type, component, location_id):
+        code = self._key_codes.get((blood_type, component, location_id))
+        if code is None:
+            return 0
+        return int(self._levels(np.array([code]), as_of)[0])
+
+    def snapshot(self, as_of):
+        codes = np.arange(len(self.keys))
+        levels = pd.Series(self._levels(codes, as_of), index=self.keys, name="units_available")
+        return levels[levels != 0].sort_index().reset_index()
+
+
+def allocations_from_requests(requests, lots):
+    # Fulfilled requests as allocations when allocation.py has not been run.
+    # Requests carry no lot, so each one is matched first-expired-first-out
+    # against the lots of its type in stock on its fulfilment date; units no lot
+    # could have supplied are dropped, so no key's level goes negative.
+    # lots need donation_id, which each allocation row carries like allocation.py's.
+    fulfilled = requests[(requests["status"] == "fulfilled") & requests["fulfilled_date"].notna()]
+    fulfilled = fulfilled.sort_values("fulfilled_date", kind="stable")
+    lot_groups = dict(list(lots.sort_values("donation_date", kind="stable").groupby(["blood_type", "component"], sort=False)))
+    rows = []
+    for (blood_type, component), group in fulfilled.groupby(["blood_type", "component"], sort=False):
+        type_lots = lot_groups.get((blood_type, component))
+        if type_lots is None:
+            continue
+        donated, expires = day_numbers(type_lots["donation_date"]), day_numbers(type_lots["expiry_date"])
+        remaining = type_lots["units"].to_numpy(np.int64).copy()
+        locations = type_lots["location_id"].to_numpy()
+        donation_ids = type_lots["donation_id"].to_numpy()
+        heap, next_lot = [], 0
+        for day, need in zip(day_numbers(group["fulfilled_date"]), group["units_requested"].to_numpy(np.int64)):
+            while next_lot < len(remaining) and donated[next_lot] <= day:
+                heapq.heappush(heap, (expires[next_lot], next_lot))
+                next_lot += 1
+            while need and heap:
+                expiry, lot = heap[0]
+                if expiry < day:
+                    heapq.heappop(heap)
+                    continue
+                taken = min(need, remaining[lot])
+                remaining[lot] -= taken
+                need -= taken
+                rows.append((donation_ids[lot], blood_type, component, locations[lot], taken, day, expiry))
+                if not remaining[lot]:
+                    heapq.heappop(heap)
+    allocations = pd.DataFrame(rows, columns=["donation_id"] + KEYS + ["units", "allocated_date", "expiry_date"])
+    for col in ("allocated_date", "expiry_date"):
+        allocations[col] = pd.to_datetime(allocations[col].to_numpy(np.int64), unit="D")
+    return allocations
+
+
+def has_table(conn, name):
+    # Checked up front rather than by catching a failed read: pandas rolls the
+    # connection back on a failed query, which would undo a caller's open
+    # transaction (the ETL and the stages read inside theirs)
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def load_engine(conn):
+    lots = pd.read_sql("""
+        SELECT donation_id, blood_type, component, location_id, units, donation_date, expiry_date
+        FROM donations
+        WHERE qc_pass = 1
+    """, conn, parse_dates=["donation_date", "expiry_date"])
+    if has_table(conn, "allocations"):
+        # Lot-level assignments from allocation.py, when it has been run
+        allocations = pd.read_sql("""
+            SELECT blood_type, component, location_id, units, allocated_date, expiry_date
+            FROM allocations
+        """, conn, parse_dates=["allocated_date", "expiry_date"])
+    else:
+        requests = pd.read_sql("""
+            SELECT blood_type, component, units_requested, status, fulfilled_date
+            FROM hospital_requests
+            WHERE status = 'fulfilled'
+        """, conn, parse_dates=["fulfilled_date"])
+        allocations = allocations_from_requests(requests, lots)
+    return InventoryEngine.from_frames(lots, allocations)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Live inventory as of a date.")
+    parser.add_argument("--as-of", type=pd.Timestamp, default=None,
+                        help="snapshot date, YYYY-MM-DD (default: today)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    as_of = (args.as_of or pd.Timestamp.today()).normalize()
+    conn = sqlite3.connect(db_path)
+    try:
+        engine = load_engine(conn)
+    finally:
+        conn.close()
+    print(engine.snapshot(as_of).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import pandas as pd
+import argparse
+import time
+
+import storage
+
+# Headless versions of the dashboard's panels. Every function takes the sidebar
+# filters ("All" for no filter) where they apply and an optional storage backend
+# (default: storage.open_storage()), and returns a pandas object; none of them
+# touch Streamlit, so they can be called from benchmarks, the CLI below or a server.
+
+# Low-cardinality text columns are returned as categoricals, other text as
+# Arrow-backed strings instead of Python objects. Only columns holding text are
+# converted: SQLite returns numeric columns of an empty or all-NULL result as
+# objects too, and those must stay numeric-compatible.
+CATEGORICAL_COLUMNS = {"blood_type", "component", "location_id", "status", "urgency"}
+
+# query -> tables it reads; callers caching results key them on these tables'
+# versions (see table_versions)
+SOURCES = {
+    "filter_options": ("donors", "stock_by_type"),
+    "kpis": ("donors", "daily_donations", "donations_30d", "stock_by_type", "daily_requests"),
+    "inventory_by_type": ("stock_by_type",),
+    "low_stock": ("days_of_supply",),
+    "donations_over_time": ("daily_donations",),
+    "request_status": ("daily_requests",),
+    "expiry_forecast": ("expiry_forecast",),
+    "wastage_rate": ("wastage_daily",),
+    "demand": ("daily_requests", "demand_forecast"),
+}
+
+
+def compact_dtypes(df):
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) == "string":
+            df[col] = df[col].astype("category" if col in CATEGORICAL_COLUMNS else "string[pyarrow]")
+    return df
+
+
+def run_query(backend, sql, params=(), parse_dates=None):
+    backend = backend or storage.open_storage()
+    return compact_dtypes(backend.query(sql, params, parse_dates))
+
+
+# Filterable panels: query -> (SQL for its rows at full blood type/component/
+# location grain, date columns). The rows are loaded once per data version into
+# a FilterIndex, and each filter selection only takes its matching rows.
+FILTER_COLUMNS = ("blood_type", "component", "location_id")
+INDEXED_QUERIES = {
+    "inventory_by_type": ("""
+        SELECT blood_type, component, location_id, units_available
+        FROM stock_by_type
+    """, None),
+    "low_stock": ("""
+        SELECT blood_type, component, location_id, units_available, avg_daily_demand, days_of_supply, alert
+        FROM days_of_supply
+        WHERE alert != 'ok'
+        ORDER BY days_of_supply
+    """, None),
+    "expiry_forecast": ("""
+        SELECT expiry_date, blood_type, component, location_id, SUM(units) AS units
+        FROM expiry_forecast
+        GROUP BY expiry_date, blood_type, component, location_id
+    """, ["expiry_date"]),
+    "wastage_rate": ("""
+        SELECT date, blood_type, component, location_id, wasted_units_window, collected_units_window
+        FROM wastage_daily
+        ORDER BY date
+    """, ["date"]),
+    # Requests have no location, so demand is indexed on blood type and component only
+    "demand": ("""
+        SELECT date, blood_type, component, SUM(units_requested) AS actual, NULL AS forecast
+        FROM daily_requests
+        GROUP BY date, blood_type, component
+        UNION ALL
+        SELECT date, blood_type, component, NULL AS actual, SUM(forecast_units) AS forecast
+        FROM demand_forecast
+        GROUP BY date, blood_type, component
+    """, ["date"]),
+}
+
+
+# Row positions of a frame for every combination of filter values ("All" for no
+# filter), grouped once when the index is built. select() takes just the matching
+# rows, or returns the frame itself when nothing is filtered, so a selection costs
+# O(matching rows) instead of a copy plus one boolean mask per filter. The frame
+# is shared between callers and must not be modified.
+class FilterIndex:
+    def __init__(self, frame):
+        self.frame = frame
+        self.columns = tuple(col for col in FILTER_COLUMNS if col in frame.columns)
+        # filtered columns -> {value(s): row positions}, for each non-empty subset
+        self.positions = {}
+        for mask in range(1, 2 ** len(self.columns)):
+            subset = tuple(col for i, col in enumerate(self.columns) if mask >> i & 1)
+            groups = frame.groupby(list(subset), observed=True, sort=False).indices
+            self.positions[subset] = {(key if isinstance(key, tuple) else (key,)): rows for key, rows in groups.items()}
+
+    def select(self, blood_type="All", component="All", location="All"):
+        chosen = dict(zip(FILTER_COLUMNS, (blood_type, component, location)))
+        subset = tuple(col for col in self.columns if chosen[col] != "All")
+        if not subset:
+            return self.frame
+        rows = self.positions[subset].get(tuple(chosen[col] for col in subset))
+        return self.frame.iloc[:0] if rows is None else self.frame.take(rows)
+
+
+def filter_index(query, backend=None):
+    sql, parse_dates = INDEXED_QUERIES[query]
+    return FilterIndex(run_query(backend, sql, parse_dates=parse_dates))
+
+
+def table_versions(backend=None):
+    # table -> run_id of the ETL run that last changed it
+    backend = backend or storage.open_storage()
+    try:
+        rows = backend.query("SELECT table_name, run_id FROM table_versions")
+    except backend.errors:
+        # Database loaded before versions were recorded
+        return {}
+    return dict(zip(rows["table_name"], rows["run_id"]))
+
+
+def filter_options(backend=None):
+    # (blood types, components, locations); each list reads a single column, and
+    # donor blood types come from the donors.blood_type index
+    backend = backend or storage.open_storage()
+
+    def distinct(column, table):
+        return backend.query(f"SELECT DISTINCT {column} FROM {table} ORDER BY {column}")[column].tolist()
+    return distinct("blood_type", "donors"), distinct("component", "stock_by_type"), distinct("location_id", "stock_by_type")
+
+
+def kpis(backend=None):
+    return run_query(backend, """
+        SELECT
+            (SELECT COUNT(*) FROM donors) AS total_donors,
+            (SELECT COALESCE(SUM(units), 0) FROM daily_donations) AS total_donated_units,
+            (SELECT COALESCE(SUM(donated_units_30d), 0) FROM donations_30d) AS donated_units_30d,
+            (SELECT COALESCE(SUM(units_available), 0) FROM stock_by_type) AS total_inventory_units,
+            (SELECT COALESCE(SUM(requests), 0) FROM daily_requests) AS total_requests
+    """).iloc[0]
+
+
+# The filterable panels take a prebuilt FilterIndex (see filter_index) or load one
+
+def inventory_by_type(blood_type="All", component="All", location="All", backend=None, index=None):
+    # Units available, blood types as rows and components as columns
+    rows = (index or filter_index("inventory_by_type", backend)).select(blood_type, component, location)
+    return rows.groupby(["blood_type", "component"], observed=True)["units_available"].sum().unstack()
+
+
+def low_stock(blood_type="All", component="All", location="All", backend=None, index=None):
+    # Keys the ETL flagged in days_of_supply against supply_thresholds, shortest supply first
+    return (index or filter_index("low_stock", backend)).select(blood_type, component, location)
+
+
+def donations_over_time(backend=None):
+    rows = run_query(backend, """
+        SELECT donation_date, SUM(units) AS units
+        FROM daily_donations
+        GROUP BY donation_date
+        ORDER BY donation_date
+    """, parse_dates=["donation_date"])
+    return rows.set_index("donation_date")["units"]
+
+
+def request_status(backend=None):
+    rows = run_query(backend, """
+        SELECT status, SUM(requests) AS count
+        FROM daily_requests
+        GROUP BY status
+        ORDER BY count DESC
+    """)
+    return rows.set_index("status")["count"]
+
+
+def expiry_forecast(blood_type="All", component="All", location="All", backend=None, index=None):
+    # Unallocated units expiring per day and blood type, from wastage.py
+    rows = (index or filter_index("expiry_forecast", backend)).select(blood_type, component, location)
+    return rows.groupby(["expiry_date", "blood_type"], observed=True)["units"].sum().unstack()
+
+
+def wastage_rate(blood_type="All", component="All", location="All", backend=None, index=None):
+    # Trailing-window wastage rate per day, from wastage.py
+    rows = (index or filter_index("wastage_rate", backend)).select(blood_type, component, location)
+    totals = rows.groupby("date")[["wasted_units_window", "collected_units_window"]].sum()
+    collected = totals["collected_units_window"]
+    rate = totals["wasted_units_window"] / collected.where(collected != 0)
+    return rate.astype("float64").rename("wastage_rate")
+
+
+def demand(blood_type="All", component="All", history_days=30, backend=None, index=None):
+    # Recent actual units requested per day next to demand_forecast.py's forecast
+    rows = (index or filter_index("demand", backend)).select(blood_type, component)
+    actual = rows.dropna(subset=["actual"]).groupby("date")["actual"].sum().tail(history_days)
+    predicted = rows.dropna(subset=["forecast"]).groupby("date")["forecast"].sum()
+    return pd.concat([actual, predicted], axis=1).sort_index()
+
+
+# query -> which filters it accepts, for the CLI and benchmarks
+QUERIES = {
+    "kpis": (kpis, ()),
+    "inventory_by_type": (inventory_by_type, ("blood_type", "component", "location")),
+    "low_stock": (low_stock, ("blood_type", "component", "location")),
+    "donations_over_time": (donations_over_time, ()),
+    "request_status": (request_status, ()),
+    "expiry_forecast": (expiry_forecast, ("blood_type", "component", "location")),
+    "wastage_rate": (wastage_rate, ("blood_type", "component", "location")),
+    "demand": (demand, ("blood_type", "component")),
+}
+
+
+def run(name, backend=None, **filters):
+    # Runs a query by name, passing only the filters it accepts
+    fn, accepted = QUERIES[name]
+    return fn(**{key: value for key, value in filters.items() if key in accepted}, backend=backend)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a dashboard query without Streamlit.")
+    parser.add_argument("query", choices=list(QUERIES))
+    parser.add_argument("--blood-type", default="All")
+    parser.add_argument("--component", default="All")
+    parser.add_argument("--location", default="All")
+    parser.add_argument("--backend", choices=list(storage.BACKENDS), default=None,
+                        help="default: $BLOOD_STORAGE, else sqlite")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    backend = storage.open_storage(args.backend)
+    started = time.perf_counter()
+    result = run(args.query, backend, blood_type=args.blood_type, component=args.component, location=args.location)
+    elapsed = time.perf_counter() - started
+    print(result.to_string())
+    print(f"{args.query}: {elapsed * 1000:.1f} ms on {backend.name}")
+
+
+if __name__ == "__main__":
+    main()
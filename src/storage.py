@@ -0,0 +1,153 @@
+import pandas as pd
+import pyarrow as pa
+import sqlite3
+import os
+
+try:
+    import duckdb
+except ImportError:  # optional: only needed for the duckdb backend
+    duckdb = None
+
+# --- Paths ---
+current_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
+project_root = os.path.abspath(os.path.join(current_dir, ".."))
+db_path = os.path.join(project_root, "blood_inventory.db")
+duckdb_path = os.path.join(project_root, "blood_inventory.duckdb")
+
+# Backend used when none is given (dashboard, stages); the ETL also has --backend
+STORAGE_ENV = "BLOOD_STORAGE"
+# Rows per batch when copying a table from SQLite into DuckDB
+COPY_BATCH_ROWS = 250_000
+# SQLite declared type prefix -> DuckDB column type
+DUCKDB_TYPES = {"INTEGER": "BIGINT", "REAL": "DOUBLE", "DATE": "DATE", "BOOLEAN": "BOOLEAN", "TEXT": "VARCHAR"}
+# DuckDB result types (SUM over integers) that pandas receives as float64; they
+# are cast back to int64 when NULL-free, as SQLite's reader returns them
+DUCKDB_WIDE_INTEGERS = {"HUGEINT", "UHUGEINT"}
+
+
+# SQLite is the ETL's own database: etl_loader and the stages write it directly,
+# so publishing is a no-op and queries read it in place.
+class SqliteStorage:
+    name = "sqlite"
+    # Raised by query() for a missing database or table
+    errors = (pd.errors.DatabaseError, sqlite3.Error)
+
+    def __init__(self, path=None):
+        self.path = path or db_path
+
+    def query(self, sql, params=(), parse_dates=None):
+        conn = sqlite3.connect(self.path)
+        try:
+            return pd.read_sql(sql, conn, params=params, parse_dates=parse_dates)
+        finally:
+            conn.close()
+
+    def publish(self, conn, tables):
+        return []
+
+
+# Columnar replica for analytics. After each ETL or stage run the changed
+# tables (and their table_versions rows) are copied from SQLite in Arrow batches with
+# their declared types, so group-bys over the base tables run vectorized
+# inside DuckDB. Connections are opened per call: DuckDB allows one writing
+# process, and the ETL must be able to publish while the dashboard is idle.
+class DuckDBStorage:
+    name = "duckdb"
+
+    def __init__(self, path=None):
+        if duckdb is None:
+            raise ImportError("the duckdb backend needs the duckdb package: pip install duckdb")
+        self.path = path or duckdb_path
+        self.errors = (duckdb.Error,)
+
+    def query(self, sql, params=(), parse_dates=None):
+        conn = duckdb.connect(self.path, read_only=True)
+        try:
+            cursor = conn.execute(sql, list(params))
+            wide = [name for name, kind, *_ in cursor.description if str(kind) in DUCKDB_WIDE_INTEGERS]
+            df = cursor.df()
+        finally:
+            conn.close()
+        for col in wide:
+            if df[col].notna().all():
+                df[col] = df[col].astype("int64")
+        for col in parse_dates or ():
+            df[col] = pd.to_datetime(df[col])
+        return df
+
+    def publish(self, conn, tables):
+        # conn: the SQLite connection the run wrote through (committed). Besides
+        # `tables`, every table the replica lacks or holds at an older version is
+        # copied, so a new replica, or one that missed runs (e.g. stages run
+        # without BLOOD_STORAGE=duckdb), catches up. Returns the tables copied.
+        target = duckdb.connect(self.path)
+        try:
+            target.execute("BEGIN")
+            tables = list(dict.fromkeys([*tables, *stale_tables(conn, target)]))
+            for table in tables:
+                copy_table(conn, target, table)
+            # The replica keeps its own table_versions, covering only the tables it holds
+            target.execute("CREATE TABLE IF NOT EXISTS table_versions (table_name VARCHAR PRIMARY KEY, run_id BIGINT NOT NULL)")
+            placeholders = ", ".join("?" * len(tables))
+            versions = conn.execute(
+                f"SELECT table_name, run_id FROM table_versions WHERE table_name IN ({placeholders})", tables
+            ).fetchall()
+            if versions:
+                target.executemany("INSERT OR REPLACE INTO table_versions VALUES (?, ?)", versions)
+            target.execute("COMMIT")
+        finally:
+            target.close()
+        return tables
+
+
+def stale_tables(conn, target):
+    # Tables whose SQLite table_versions run differs from the replica's
+    try:
+        source = dict(conn.execute("SELECT table_name, run_id FROM table_versions").fetchall())
+    except sqlite3.Error:
+        # Database loaded before versions were recorded
+        return []
+    exists = target.execute(
+        "SELECT 1 FROM information_schema.tables WHERE table_name = 'table_versions'").fetchone()
+    replica = dict(target.execute("SELECT table_name, run_id FROM table_versions").fetchall()) if exists else {}
+    return [table for table, run_id in source.items() if replica.get(table) != run_id]
+
+
+def duckdb_columns(conn, table):
+    # (name, DuckDB type) for each column of a SQLite table
+    columns = []
+    for _, name, decl, *_ in conn.execute(f"PRAGMA table_info({table})"):
+        kind = next((t for prefix, t in DUCKDB_TYPES.items() if decl.upper().startswith(prefix)), "VARCHAR")
+        columns.append((name, kind))
+    return columns
+
+
+def copy_table(conn, target, table):
+    # A table missing from SQLite (e.g. dropped allocations) is dropped from the replica too
+    columns = duckdb_columns(conn, table)
+    target.execute(f"DROP TABLE IF EXISTS {table}")
+    if not columns:
+        return
+    names = [name for name, _ in columns]
+    target.execute(f"CREATE TABLE {table} (" + ", ".join(f"{n} {t}" for n, t in columns) + ")")
+    casts = ", ".join(f"CAST({n} AS {t}) AS {n}" for n, t in columns)
+    cursor = conn.execute(f"SELECT {', '.join(names)} FROM {table}")
+    while True:
+        rows = cursor.fetchmany(COPY_BATCH_ROWS)
+        if not rows:
+            break
+        batch = pa.table({name: list(values) for name, values in zip(names, zip(*rows))})
+        target.register("incoming_batch", batch)
+        target.execute(f"INSERT INTO {table} SELECT {casts} FROM incoming_batch")
+        target.unregister("incoming_batch")
+
+
+BACKENDS = {"sqlite": SqliteStorage, "duckdb": DuckDBStorage}
+
+
+def open_storage(name=None, path=None):
+    # name defaults to $BLOOD_STORAGE, then sqlite
+    name = name or os.environ.get(STORAGE_ENV) or "sqlite"
+    if name not in BACKENDS:
+        raise ValueError(f"unknown storage backend {name!r}; choose from {', '.join(BACKENDS)}")
+    return BACKENDS[name](path)
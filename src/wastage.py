@@ -0,0 +1,178 @@
+import pandas as pd
+import numpy as np
+import sqlite3
+import argparse
+import time
+import os
+
+import etl_loader
+from inventory_engine import KEYS, allocations_from_requests, day_number, day_numbers, has_table
+
+# --- Paths ---
+current_dir = os.path.dirname(__file__) if "__file__" in globals() else os.getcwd()
+project_root = os.path.abspath(os.path.join(current_dir, ".."))
+db_path = os.path.join(project_root, "blood_inventory.db")
+
+# Days ahead covered by the expiry projection
+HORIZON_DAYS = 14
+# Trailing window of the wastage rate
+WINDOW_DAYS = 30
+
+# --- Materialized tables ---
+# Both are rebuilt as a whole on every run; the dashboard reads them directly
+TABLES = {
+    "expiry_forecast": {
+        "primary_key": "expiry_date, blood_type, component, location_id",
+        "columns": [
+            ("expiry_date", "DATE NOT NULL"),
+            ("blood_type", "TEXT NOT NULL"),
+            ("component", "TEXT NOT NULL"),
+            ("location_id", "TEXT NOT NULL"),
+            ("units", "INTEGER NOT NULL"),
+        ],
+    },
+    "wastage_daily": {
+        "primary_key": "date, blood_type, component, location_id",
+        "columns": [
+            ("date", "DATE NOT NULL"),
+            ("blood_type", "TEXT NOT NULL"),
+            ("component", "TEXT NOT NULL"),
+            ("location_id", "TEXT NOT NULL"),
+            ("collected_units", "INTEGER NOT NULL"),
+            ("expired_units", "INTEGER NOT NULL"),
+            ("discarded_units", "INTEGER NOT NULL"),
+            ("collected_units_window", "INTEGER NOT NULL"),
+            ("wasted_units_window", "INTEGER NOT NULL"),
+            ("wastage_rate", "REAL"),
+        ],
+    },
+}
+
+
+def read_lots(conn, as_of):
+    # Every donation with the units allocated from it up to as_of; without an
+    # allocations table (allocation.py not run) the fulfilled requests are matched
+    # to lots by inventory_engine's first-expired-first-out fallback
+    lots = pd.read_sql("""
+        SELECT donation_id, blood_type, component, location_id, units, donation_date, expiry_date, qc_pass
+        FROM donations
+    """, conn, parse_dates=["donation_date", "expiry_date"])
+    if has_table(conn, "allocations"):
+        allocated = pd.read_sql("""
+            SELECT donation_id, SUM(units) AS allocated_units
+            FROM allocations
+            WHERE allocated_date <= ?
+            GROUP BY donation_id
+        """, conn, params=(as_of.date().isoformat(),))
+    else:
+        requests = pd.read_sql("""
+            SELECT blood_type, component, units_requested, status, fulfilled_date
+            FROM hospital_requests
+            WHERE status = 'fulfilled' AND fulfilled_date <= ?
+        """, conn, params=(as_of.date().isoformat(),), parse_dates=["fulfilled_date"])
+        allocations = allocations_from_requests(requests, lots[lots["qc_pass"] == 1])
+        allocated = (allocations.groupby("donation_id", as_index=False)["units"].sum()
+                     .rename(columns={"units": "allocated_units"}))
+    lots = lots.merge(allocated, on="donation_id", how="left")
+    lots["allocated_units"] = lots["allocated_units"].fillna(0).astype("int64")
+    return lots
+
+
+def projected_expiries(lots, as_of, horizon_days=HORIZON_DAYS):
+    # Unallocated units of live QC-passed lots that expire within the horizon,
+    # per key and expiry date (the last day the unit is usable)
+    day = day_number(as_of)
+    expiry = day_numbers(lots["expiry_date"])
+    left = lots["units"].to_numpy(np.int64) - lots["allocated_units"].to_numpy(np.int64)
+    live = (lots["qc_pass"].to_numpy(bool) & (day_numbers(lots["donation_date"]) <= day)
+            & (expiry >= day) & (expiry < day + horizon_days) & (left > 0))
+    soon = lots.loc[live, KEYS].assign(expiry_date=lots.loc[live, "expiry_date"], units=left[live])
+    forecast = soon.groupby(["expiry_date"] + KEYS, as_index=False, observed=True)["units"].sum()
+    return forecast[[name for name, _ in TABLES["expiry_forecast"]["columns"]]]
+
+
+def wastage_daily(lots, as_of, window_days=WINDOW_DAYS):
+    # Daily collected, expired-unused and QC-discarded units per key on a dense
+    # (day x key) grid, with trailing window sums taken from cumulative sums.
+    # A lot's leftover units count as wasted on its expiry date once that has passed.
+    day = day_number(as_of)
+    if lots.empty:
+        return pd.DataFrame(columns=[name for name, _ in TABLES["wastage_daily"]["columns"]])
+    codes, keys = pd.MultiIndex.from_frame(lots[KEYS]).factorize()
+    donated, expiry = day_numbers(lots["donation_date"]), day_numbers(lots["expiry_date"])
+    units = lots["units"].to_numpy(np.int64)
+    qc_pass = lots["qc_pass"].to_numpy(bool)
+    leftover = np.maximum(units - lots["allocated_units"].to_numpy(np.int64), 0)
+
+    first = int(donated.min())
+    n_days, n_keys = max(int(day) - first + 1, 0), len(keys)
+    collected = np.zeros((n_days, n_keys), dtype=np.int64)
+    expired = np.zeros((n_days, n_keys), dtype=np.int64)
+    discarded = np.zeros((n_days, n_keys), dtype=np.int64)
+    seen = donated <= day
+    np.add.at(collected, (donated[seen] - first, codes[seen]), units[seen])
+    np.add.at(discarded, (donated[seen & ~qc_pass] - first, codes[seen & ~qc_pass]), units[seen & ~qc_pass])
+    gone = qc_pass & (expiry < day)
+    np.add.at(expired, (expiry[gone] - first, codes[gone]), leftover[gone])
+
+    def trailing(daily):
+        total = np.cumsum(daily, axis=0)
+        total[window_days:] -= total[:-window_days].copy()
+        return total
+
+    collected_window = trailing(collected)
+    wasted_window = trailing(expired + discarded)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(collected_window > 0, wasted_window / collected_window, np.nan)
+
+    dates = np.arange(first, first + n_days).astype("datetime64[D]")
+    frame = pd.DataFrame({
+        "date": np.repeat(dates, n_keys),
+        "blood_type": np.tile(keys.get_level_values(0), n_days),
+        "component": np.tile(keys.get_level_values(1), n_days),
+        "location_id": np.tile(keys.get_level_values(2), n_days),
+        "collected_units": collected.ravel(),
+        "expired_units": expired.ravel(),
+        "discarded_units": discarded.ravel(),
+        "collected_units_window": collected_window.ravel(),
+        "wasted_units_window": wasted_window.ravel(),
+        "wastage_rate": rate.ravel(),
+    })
+    return frame
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Project upcoming expiries and historical wastage rates.")
+    parser.add_argument("--as-of", type=pd.Timestamp, default=None,
+                        help="forecast from this date, YYYY-MM-DD (default: today)")
+    parser.add_argument("--horizon-days", type=int, default=HORIZON_DAYS,
+                        help=f"days ahead to project expiries over (default {HORIZON_DAYS})")
+    parser.add_argument("--window-days", type=int, default=WINDOW_DAYS,
+                        help=f"trailing window of the wastage rate (default {WINDOW_DAYS})")
+    args = parser.parse_args(argv)
+    if args.horizon_days <= 0 or args.window_days <= 0:
+        parser.error("--horizon-days and --window-days must be positive")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    as_of = (args.as_of or pd.Timestamp.today()).normalize()
+
+    conn = sqlite3.connect(db_path)
+    with etl_loader.stage_run(conn, "wastage") as run:
+        started = time.perf_counter()
+        lots = read_lots(conn, as_of)
+        forecast = projected_expiries(lots, as_of, args.horizon_days)
+        daily = wastage_daily(lots, as_of, args.window_days)
+        print(f"Computed from {len(lots)} donations in {time.perf_counter() - started:.2f}s")
+        etl_loader.write_aggregate(conn, "expiry_forecast", TABLES["expiry_forecast"], forecast)
+        etl_loader.write_aggregate(conn, "wastage_daily", TABLES["wastage_daily"], daily)
+        run.update(rows=len(forecast) + len(daily), changed=list(TABLES))
+    conn.close()
+    print(f"{int(forecast['units'].sum())} units expire in the next {args.horizon_days} days")
+    print(f"Wastage tables written to {db_path}")
+
+
+if __name__ == "__main__":
+    main()
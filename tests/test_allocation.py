@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import sys
+import unittest
+from datetime import date
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import data_gen  # noqa: E402
+import etl_loader  # noqa: E402
+from allocation import allocate, is_compatible, write_outcomes  # noqa: E402
+from domain import BLOOD_TYPES  # noqa: E402
+
+# Standard red cell compatibility: recipient -> donor types it may receive
+RED_CELL_DONORS = {
+    "O-": {"O-"},
+    "O+": {"O-", "O+"},
+    "A-": {"O-", "A-"},
+    "A+": {"O-", "O+", "A-", "A+"},
+    "B-": {"O-", "B-"},
+    "B+": {"O-", "O+", "B-", "B+"},
+    "AB-": {"O-", "A-", "B-", "AB-"},
+    "AB+": set(BLOOD_TYPES),
+}
+# Standard plasma compatibility by ABO group; Rh does not apply
+PLASMA_DONOR_GROUPS = {"O": {"O", "A", "B", "AB"}, "A": {"A", "AB"}, "B": {"B", "AB"}, "AB": {"AB"}}
+
+
+def lots(*rows):
+    # (donation_id, blood_type, component, units, donation_date, expiry_date)
+    df = pd.DataFrame(list(rows), columns=["donation_id", "blood_type", "component", "units", "donation_date", "expiry_date"])
+    df["location_id"] = "L1"
+    for col in ("donation_date", "expiry_date"):
+        df[col] = pd.to_datetime(df[col])
+    return df
+
+
+def requests(*rows):
+    # (request_id, blood_type, component, units_requested, request_date)
+    df = pd.DataFrame(list(rows), columns=["request_id", "blood_type", "component", "units_requested", "request_date"])
+    df["request_date"] = pd.to_datetime(df["request_date"])
+    df["urgency"] = "medium"
+    return df
+
+
+class CompatibilityTest(unittest.TestCase):
+    def test_whole_blood_follows_red_cell_table(self):
+        for recipient, donors in RED_CELL_DONORS.items():
+            for donor in BLOOD_TYPES:
+                self.assertEqual(is_compatible("whole_blood", recipient, donor), donor in donors, (recipient, donor))
+
+    def test_plasma_follows_abo_table_for_either_rh(self):
+        for recipient in BLOOD_TYPES:
+            for donor in BLOOD_TYPES:
+                expected = donor[:-1] in PLASMA_DONOR_GROUPS[recipient[:-1]]
+                self.assertEqual(is_compatible("plasma", recipient, donor), expected, (recipient, donor))
+
+    def test_platelets_use_plasma_abo_and_red_cell_rh(self):
+        for recipient in BLOOD_TYPES:
+            for donor in BLOOD_TYPES:
+                expected = (donor[:-1] in PLASMA_DONOR_GROUPS[recipient[:-1]]
+                            and not (recipient.endswith("-") and donor.endswith("+")))
+                self.assertEqual(is_compatible("platelets", recipient, donor), expected, (recipient, donor))
+
+
+class AllocateTest(unittest.TestCase):
+    def assertValidAssignments(self, lot_frame, outcomes, assignments):
+        # No lot gives more units than it holds, draws fall within each lot's
+        # donation..expiry dates, and fulfilled requests get exactly what they asked for
+        lot_frame = lot_frame.set_index("donation_id")
+        drawn = assignments.groupby("donation_id")["units"].sum()
+        self.assertTrue((drawn <= lot_frame.loc[drawn.index, "units"]).all())
+        source = lot_frame.loc[assignments["donation_id"]]
+        self.assertTrue((assignments["allocated_date"].to_numpy() >= source["donation_date"].to_numpy()).all())
+        self.assertTrue((assignments["allocated_date"].to_numpy() <= source["expiry_date"].to_numpy()).all())
+        filled = outcomes.loc[outcomes["status"] == "fulfilled", "request_id"]
+        self.assertEqual(set(assignments["request_id"]), set(filled))
+
+    def test_first_expired_first_out(self):
+        lot_frame = lots(("DN1", "A+", "plasma", 3, "2026-01-01", "2026-01-20"),
+                         ("DN2", "A+", "plasma", 3, "2026-01-02", "2026-01-10"))
+        outcomes, assignments = allocate(lot_frame, requests(("R1", "A+", "plasma", 4, "2026-01-03")), "2026-01-31")
+        self.assertEqual(assignments[["donation_id", "units"]].values.tolist(), [["DN2", 3], ["DN1", 1]])
+        self.assertValidAssignments(lot_frame, outcomes, assignments)
+
+    def test_same_day_requests_are_served_most_urgent_first(self):
+        lot_frame = lots(("DN1", "A+", "plasma", 2, "2026-01-01", "2026-01-20"))
+        for low, high in (("low", "high"), ("routine", "emergency"), ("urgent", "emergency"), ("routine", "urgent")):
+            reqs = requests(("R1", "A+", "plasma", 2, "2026-01-03"), ("R2", "A+", "plasma", 2, "2026-01-03"))
+            reqs["urgency"] = [low, high]
+            outcomes, _ = allocate(lot_frame, reqs, "2026-01-31", window_days=2)
+            self.assertEqual(outcomes["status"].tolist(), ["cancelled", "fulfilled"], (low, high))
+
+    def test_expired_and_future_lots_are_not_used(self):
+        lot_frame = lots(("DN1", "A+", "plasma", 5, "2026-01-01", "2026-01-04"),
+                         ("DN2", "A+", "plasma", 5, "2026-01-20", "2026-01-30"))
+        outcomes, assignments = allocate(lot_frame, requests(("R1", "A+", "plasma", 2, "2026-01-05")), "2026-01-31",
+                                         window_days=3)
+        self.assertEqual(outcomes["status"].tolist(), ["cancelled"])
+        self.assertTrue(assignments.empty)
+
+    def test_generated_data_never_overallocates(self):
+        donations, reqs = generated(seed=1, n_donations=5000, n_requests=3000)
+        for substitute in (False, True):
+            outcomes, assignments = allocate(donations, reqs, pd.Timestamp.today().normalize(), substitute=substitute)
+            self.assertValidAssignments(donations, outcomes, assignments)
+
+
+class SubstitutionTest(unittest.TestCase):
+    def test_short_request_is_filled_from_spare_compatible_stock(self):
+        lot_frame = lots(("DN1", "A+", "whole_blood", 1, "2026-01-01", "2026-01-30"),
+                         ("DN2", "O-", "whole_blood", 4, "2026-01-01", "2026-01-30"))
+        outcomes, assignments = allocate(lot_frame, requests(("R1", "A+", "whole_blood", 3, "2026-01-02")),
+                                         "2026-01-31", window_days=2, substitute=True)
+        self.assertEqual(outcomes[["status", "substituted"]].values.tolist(), [["fulfilled", True]])
+        self.assertEqual(outcomes["fulfilled_date"].tolist(), [pd.Timestamp("2026-01-04")])
+        self.assertEqual(sorted(assignments[["donation_id", "units"]].values.tolist()), [["DN1", 1], ["DN2", 2]])
+
+    def test_substitute_stock_needed_by_its_own_type_is_left_alone(self):
+        # O- has exactly what the later O- request needs, so A+ must not take it
+        lot_frame = lots(("DN1", "O-", "whole_blood", 2, "2026-01-01", "2026-01-30"))
+        outcomes, _ = allocate(lot_frame, requests(("R1", "A+", "whole_blood", 2, "2026-01-02"),
+                                                   ("R2", "O-", "whole_blood", 2, "2026-01-10")),
+                               "2026-01-31", window_days=2, substitute=True)
+        self.assertEqual(outcomes["status"].tolist(), ["cancelled", "fulfilled"])
+
+    def test_substitution_never_lowers_fulfilment(self):
+        for seed, n_donations, n_requests in ((0, 4000, 2000), (1, 4000, 3000), (2, 4000, 6000)):
+            donations, reqs = generated(seed, n_donations, n_requests)
+            as_of = pd.Timestamp.today().normalize()
+            plain, _ = allocate(donations, reqs, as_of)
+            substituted, _ = allocate(donations, reqs, as_of, substitute=True)
+            gained = (substituted["status"] == "fulfilled").sum() - (plain["status"] == "fulfilled").sum()
+            self.assertGreaterEqual(gained, 0)
+            self.assertEqual(gained, substituted["substituted"].sum())
+
+
+class WriteOutcomesTest(unittest.TestCase):
+    def test_backdated_replay_refreshes_aggregates_as_of_today(self):
+        donations, reqs = generated(0, 500, 100)
+        conn = sqlite3.connect(":memory:")
+        self.addCleanup(conn.close)
+        etl_loader.replace_table(conn, "donations", donations, bulk=True)
+        etl_loader.replace_table(conn, "hospital_requests", reqs, bulk=True)
+        outcomes, assignments = allocate(donations, reqs, pd.Timestamp("2020-01-01"))
+        with mock.patch.object(etl_loader, "refresh_aggregates", return_value=[]) as refresh:
+            write_outcomes(conn, outcomes, assignments)
+        self.assertEqual(refresh.call_args.args[2], date.today().isoformat())
+
+
+def generated(seed, n_donations, n_requests):
+    rng = np.random.default_rng(seed)
+    donors = data_gen.generate_donors(rng, n_donations // 10)
+    donations = data_gen.generate_donations(rng, donors, n_donations)
+    return donations[donations["qc_pass"] == 1], data_gen.generate_requests(rng, n_requests)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import data_gen  # noqa: E402
+
+AS_OF = pd.Timestamp("2026-03-31")
+
+
+class ShardedGenerationTest(unittest.TestCase):
+    def shards(self, workers, num_donations=2500, num_requests=700, shard_rows=400):
+        # The shard tasks data_gen.main builds, run inline or on a process pool
+        donors_seed, donations_seed, requests_seed = np.random.SeedSequence(7).spawn(3)
+        donors = data_gen.generate_donors(np.random.default_rng(donors_seed), 100)
+        donation_chunks = list(data_gen.iter_chunks(num_donations, shard_rows))
+        request_chunks = list(data_gen.iter_chunks(num_requests, shard_rows))
+        donation_tasks = [(seed, start, count, AS_OF, False) for seed, (start, count)
+                          in zip(donations_seed.spawn(len(donation_chunks)), donation_chunks)]
+        request_tasks = [(seed, start, count, AS_OF, False) for seed, (start, count)
+                         in zip(requests_seed.spawn(len(request_chunks)), request_chunks)]
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(workers, initializer=data_gen._init_worker, initargs=(donors,))
+        else:
+            data_gen._init_worker(donors)
+        try:
+            window = 2 * workers
+            donations = list(data_gen._run_shards(executor, data_gen._donation_shard, donation_tasks, window))
+            requests = list(data_gen._run_shards(executor, data_gen._request_shard, request_tasks, window))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return (pd.concat([chunk for chunk, _ in donations], ignore_index=True),
+                pd.concat(requests, ignore_index=True))
+
+    def test_pool_matches_inline_shards(self):
+        inline_donations, inline_requests = self.shards(workers=1)
+        pooled_donations, pooled_requests = self.shards(workers=3)
+        self.assertEqual(len(inline_donations), 2500)
+        self.assertEqual(inline_donations["donation_date"].max(), np.datetime64(AS_OF.date(), "D"))
+        self.assertTrue(inline_donations["donation_id"].is_unique)
+        pd.testing.assert_frame_equal(inline_donations, pooled_donations)
+        pd.testing.assert_frame_equal(inline_requests, pooled_requests)
+
+    def test_csv_output_is_identical_for_any_worker_count(self):
+        outputs = {}
+        for workers in (1, 3):
+            with tempfile.TemporaryDirectory() as directory, \
+                    mock.patch.object(data_gen, "data_dir", directory), \
+                    contextlib.redirect_stdout(io.StringIO()):
+                data_gen.main(["--seed", "11", "--donations", "1200", "--requests", "300", "--chunk-size", "250",
+                               "--as-of", AS_OF.date().isoformat(), "--workers", str(workers)])
+                outputs[workers] = {}
+                for name in sorted(os.listdir(directory)):
+                    with open(os.path.join(directory, name), "rb") as f:
+                        outputs[workers][name] = f.read()
+        self.assertEqual(sorted(outputs[1]), ["donations.csv", "donors.csv", "hospital_requests.csv", "inventory.csv"])
+        self.assertEqual(outputs[1], outputs[3])
+        # History ends on --as-of, so the snapshot holds stock whatever today's date
+        self.assertGreater(outputs[1]["inventory.csv"].count(b"\n"), 1)
+
+    def test_history_is_anchored_to_as_of(self):
+        donors = data_gen.generate_donors(np.random.default_rng(0), 20)
+        donations = data_gen.generate_donations(np.random.default_rng(1), donors, 500, as_of=AS_OF)
+        requests = data_gen.generate_requests(np.random.default_rng(2), 500, as_of=AS_OF)
+        first = AS_OF - pd.Timedelta(days=data_gen.HISTORY_DAYS)
+        for dates in (pd.to_datetime(donations["donation_date"]), pd.to_datetime(requests["request_date"])):
+            self.assertEqual(dates.max(), AS_OF)
+            self.assertGreaterEqual(dates.min(), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
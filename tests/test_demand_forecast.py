@@ -0,0 +1,57 @@
+import os
+import sys
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from demand_forecast import fit_exponential_smoothing, forecast  # noqa: E402
+
+
+class ExponentialSmoothingTest(unittest.TestCase):
+    def test_level_and_alpha_match_hand_computed_series(self):
+        # Columns: alternating, constant and trending demand. Levels start at the
+        # first value and move by alpha x the one-step-ahead error:
+        #   [10, 0, 10]  alpha 0.5: errors -10, 5  -> SSE 125, level 7.5
+        #                alpha 1.0: errors -10, 10 -> SSE 200, level 10
+        #   [3, 3, 3]    no error for any alpha, so the first alpha is kept
+        #   [0, 10, 20]  alpha 0.5: errors 10, 15  -> SSE 325, level 12.5
+        #                alpha 1.0: errors 10, 10  -> SSE 200, level 20
+        y = np.array([[10, 3, 0], [0, 3, 10], [10, 3, 20]])
+        level, alpha, rmse = fit_exponential_smoothing(y, alphas=[0.5, 1.0])
+        np.testing.assert_allclose(level, [7.5, 3.0, 20.0])
+        np.testing.assert_allclose(alpha, [0.5, 0.5, 1.0])
+        np.testing.assert_allclose(rmse, [np.sqrt(125 / 2), 0.0, 10.0])
+
+    def test_single_day_keeps_its_value(self):
+        level, alpha, rmse = fit_exponential_smoothing(np.array([[4.0, 0.0]]), alphas=[0.3])
+        np.testing.assert_allclose(level, [4.0, 0.0])
+        np.testing.assert_allclose(rmse, [0.0, 0.0])
+
+    def test_forecast_is_flat_over_the_horizon(self):
+        days = pd.date_range("2026-03-01", periods=3, freq="D", name="request_date")
+        columns = pd.MultiIndex.from_tuples([("H1", "A+", "plasma")], names=["hospital_id", "blood_type", "component"])
+        demand = pd.DataFrame([[10], [0], [10]], index=days, columns=columns)
+        rows = forecast(demand, pd.Timestamp("2026-03-03"), horizon_days=2)
+        self.assertEqual(rows["date"].dt.strftime("%Y-%m-%d").tolist(), ["2026-03-04", "2026-03-05"])
+        self.assertEqual(rows["forecast_units"].nunique(), 1)
+        self.assertEqual(rows["hospital_id"].tolist(), ["H1", "H1"])
+
+    def test_workers_split_the_series_without_changing_the_fit(self):
+        days = pd.date_range("2026-03-01", periods=20, freq="D", name="request_date")
+        columns = pd.MultiIndex.from_product([["H1", "H2", "H3"], ["A+"], ["plasma", "platelets"]],
+                                             names=["hospital_id", "blood_type", "component"])
+        demand = pd.DataFrame(np.random.default_rng(0).integers(0, 6, (20, 6)), index=days, columns=columns)
+        as_of = pd.Timestamp("2026-03-20")
+        single = forecast(demand, as_of, horizon_days=3)
+        with mock.patch("demand_forecast.ProcessPoolExecutor", wraps=ProcessPoolExecutor) as pool:
+            pooled = forecast(demand, as_of, horizon_days=3, workers=4)
+        pool.assert_called_once_with(4)
+        pd.testing.assert_frame_equal(single, pooled)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import data_gen  # noqa: E402
+import etl_loader  # noqa: E402
+
+AS_OF = "2026-03-31"
+
+
+def load(conn, donations=(), requests=(), inventory=()):
+    # Small fixed tables through the ETL's own writer and aggregate refresh
+    donations = pd.DataFrame(list(donations), columns=[
+        "donation_id", "blood_type", "component", "units", "donation_date", "location_id"])
+    donations["donor_id"] = "D1"
+    donations["expiry_date"] = pd.to_datetime(donations["donation_date"]) + pd.Timedelta(days=30)
+    donations["qc_pass"] = 1
+    requests = pd.DataFrame(list(requests), columns=[
+        "request_id", "blood_type", "component", "units_requested", "request_date"])
+    requests["hospital_id"], requests["status"], requests["urgency"], requests["fulfilled_date"] = "H1", "pending", "routine", None
+    inventory = pd.DataFrame(list(inventory), columns=["inventory_id", "blood_type", "component", "units_available", "location_id"])
+    inventory["last_updated"], inventory["notes"] = AS_OF, None
+    for table, df in (("donations", donations), ("hospital_requests", requests), ("inventory", inventory)):
+        etl_loader.replace_table(conn, table, df, bulk=True)
+    etl_loader.refresh_aggregates(conn, {}, AS_OF)
+
+
+def days_of_supply(conn):
+    return pd.read_sql("SELECT * FROM days_of_supply", conn).set_index(["blood_type", "component", "location_id"])
+
+
+class DaysOfSupplyTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_stock_out_without_recent_collections_is_critical(self):
+        # A+ is requested but has neither stock nor recent donations anywhere
+        load(self.conn,
+             donations=[("DN1", "B+", "whole_blood", 5, "2026-03-20", "L1")],
+             requests=[(f"R{i}", "A+", "whole_blood", 5, f"2026-03-{20 + i}") for i in range(9)],
+             inventory=[("I1", "B+", "whole_blood", 10, "L1")])
+        row = days_of_supply(self.conn).loc[("A+", "whole_blood", "L1")]
+        self.assertEqual(row["units_available"], 0)
+        self.assertGreater(row["avg_daily_demand"], 0)
+        self.assertEqual(row["days_of_supply"], 0)
+        self.assertEqual(row["alert"], "critical")
+
+    def test_demand_without_intake_is_split_evenly(self):
+        load(self.conn,
+             donations=[("DN1", "B+", "plasma", 5, "2026-03-20", "L1"), ("DN2", "B+", "plasma", 5, "2026-03-20", "L2")],
+             requests=[("R1", "O-", "plasma", 28, "2026-03-25")])
+        demand = days_of_supply(self.conn).xs(("O-", "plasma"))["avg_daily_demand"]
+        self.assertEqual(set(demand.index), {"L1", "L2"})
+        self.assertAlmostEqual(demand["L1"], demand["L2"])
+        self.assertAlmostEqual(demand.sum(), 1.0)
+
+    def test_stock_without_recent_intake_still_has_demand(self):
+        # DN2 was collected before the demand window but has not expired
+        load(self.conn,
+             donations=[("DN1", "A-", "plasma", 50, "2026-03-20", "L1"), ("DN2", "A-", "plasma", 3, "2026-03-03", "L2")],
+             requests=[("R1", "A-", "plasma", 56, "2026-03-25")])
+        rows = days_of_supply(self.conn).xs(("A-", "plasma"))
+        self.assertEqual(rows.loc["L2", "units_available"], 3)
+        self.assertGreater(rows.loc["L2", "avg_daily_demand"], 0)
+        self.assertGreater(rows.loc["L1", "avg_daily_demand"], rows.loc["L2", "avg_daily_demand"])
+        self.assertAlmostEqual(rows["avg_daily_demand"].sum(), 2.0)
+        self.assertFalse(pd.isna(rows.loc["L2", "days_of_supply"]))
+
+    def test_supply_counts_live_stock_not_the_inventory_snapshot(self):
+        # DN1 expired on 2026-03-02; 4 of DN2's 10 units went to a fulfilled request
+        load(self.conn,
+             donations=[("DN1", "O+", "plasma", 6, "2026-01-31", "L1"), ("DN2", "O+", "plasma", 10, "2026-03-10", "L1")],
+             requests=[("R1", "O+", "plasma", 4, "2026-03-12")],
+             inventory=[("I1", "O+", "plasma", 100, "L1")])
+        self.conn.execute("UPDATE hospital_requests SET status = 'fulfilled', fulfilled_date = '2026-03-12'")
+        etl_loader.refresh_aggregates(self.conn, {"hospital_requests": None}, AS_OF)
+        stock = pd.read_sql("SELECT * FROM stock_by_type", self.conn)
+        self.assertEqual(stock.values.tolist(), [["O+", "plasma", "L1", 6]])
+        self.assertEqual(days_of_supply(self.conn).loc[("O+", "plasma", "L1"), "units_available"], 6)
+
+    def test_supply_subtracts_allocations_charged_to_live_lots(self):
+        # DN2 gave 3 units before the as-of day and 2 after; DN1's allocation is
+        # from a lot that has since expired
+        load(self.conn,
+             donations=[("DN1", "O+", "plasma", 6, "2026-01-31", "L1"), ("DN2", "O+", "plasma", 10, "2026-03-10", "L2")])
+        allocations = pd.DataFrame([
+            ("R1", "DN1", "O+", "plasma", "L1", 6, "2026-02-01", "2026-03-02"),
+            ("R2", "DN2", "O+", "plasma", "L2", 3, "2026-03-12", "2026-04-09"),
+            ("R3", "DN2", "O+", "plasma", "L2", 2, "2026-04-02", "2026-04-09"),
+        ], columns=[name for name, _ in etl_loader.SCHEMA["allocations"]])
+        etl_loader.replace_table(self.conn, "allocations", allocations, bulk=True)
+        etl_loader.refresh_aggregates(self.conn, {}, AS_OF)
+        stock = pd.read_sql("SELECT * FROM stock_by_type", self.conn)
+        self.assertEqual(stock.values.tolist(), [["O+", "plasma", "L2", 7]])
+
+
+class UpsertTest(unittest.TestCase):
+    def test_both_writers_replace_existing_keys(self):
+        frames = {}
+        for bulk in (True, False):
+            conn = sqlite3.connect(":memory:")
+            load(conn, donations=[("DN1", "A+", "plasma", 1, "2026-03-01", "L1"), ("DN2", "A+", "plasma", 2, "2026-03-02", "L1")])
+            incoming = pd.read_sql("SELECT * FROM donations WHERE donation_id = 'DN2'", conn, parse_dates=["donation_date", "expiry_date"])
+            incoming = pd.concat([incoming.assign(units=5, donation_date=pd.Timestamp("2026-03-05")),
+                                  incoming.assign(donation_id="DN3")])
+            touched = etl_loader.upsert_rows(conn, "donations", incoming, bulk)
+            self.assertEqual(touched, {"2026-03-02", "2026-03-05"})
+            frames[bulk] = pd.read_sql("SELECT donation_id, units, donation_date FROM donations ORDER BY donation_id", conn)
+            conn.close()
+        self.assertEqual(frames[True].values.tolist(), [["DN1", 1, "2026-03-01"], ["DN2", 5, "2026-03-05"], ["DN3", 2, "2026-03-02"]])
+        pd.testing.assert_frame_equal(frames[True], frames[False])
+
+
+class CsvIncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.data = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(etl_loader, "data_dir", self.data.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.data.cleanup)
+        self.conn = sqlite3.connect(":memory:")
+        self.addCleanup(self.conn.close)
+        etl_loader.ensure_state_table(self.conn)
+        rng = np.random.default_rng(0)
+        self.donors = data_gen.generate_donors(rng, 50)
+        self.sink = data_gen.CsvSink(self.data.name)
+        self.sink.write("donations", data_gen.generate_donations(rng, self.donors, 200, 0))
+        self.path = os.path.join(self.data.name, "donations.csv")
+
+    def load(self):
+        return etl_loader.load_incremental(self.conn, "donations", True, "csv")
+
+    def test_appended_rows_are_upserted(self):
+        self.assertEqual(self.load(), (200, None))
+        self.sink.write("donations", data_gen.generate_donations(np.random.default_rng(1), self.donors, 30, 200))
+        rows, touched = self.load()
+        self.assertEqual(rows, 30)
+        self.assertIsNotNone(touched)
+        self.assertEqual(self.load(), (0, set()))
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM donations").fetchone()[0], 230)
+
+    def test_row_edited_in_place_is_reloaded(self):
+        self.load()
+        df = pd.read_csv(self.path, dtype=str, keep_default_na=False)
+        units = df.loc[0, "units"]
+        df.loc[0, "units"] = "9" if units != "9" else "8"
+        df.to_csv(self.path, index=False)
+        self.assertEqual(os.path.getsize(self.path), etl_loader.get_state(self.conn, "donations")[0])
+        self.assertEqual(self.load(), (200, None))
+        loaded = self.conn.execute("SELECT units FROM donations WHERE donation_id = ?", (df.loc[0, "donation_id"],))
+        self.assertEqual(loaded.fetchone()[0], int(df.loc[0, "units"]))
+
+
+class ParquetIncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.data = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(etl_loader, "data_dir", self.data.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.data.cleanup)
+        self.conn = sqlite3.connect(":memory:")
+        self.addCleanup(self.conn.close)
+        etl_loader.ensure_state_table(self.conn)
+        etl_loader.ensure_files_table(self.conn)
+
+    def generate(self, seed, num_donations, chunk_size):
+        # The same chunked writes data_gen.py --sink parquet makes
+        rng = np.random.default_rng(seed)
+        donors = data_gen.generate_donors(rng, 50)
+        sink = data_gen.ParquetSink(self.data.name)
+        for start, count in data_gen.iter_chunks(num_donations, chunk_size):
+            sink.write("donations", data_gen.generate_donations(rng, donors, count, start))
+
+    def load(self):
+        return etl_loader.load_incremental(self.conn, "donations", True, "parquet")
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM donations").fetchone()[0]
+
+    def test_regenerated_dataset_is_reloaded_in_full(self):
+        self.generate(0, 300, 100)
+        self.assertEqual(self.load(), (300, None))
+        self.assertEqual(self.load(), (0, set()))
+        self.generate(1, 250, 100)
+        self.assertEqual(self.load(), (250, None))
+        self.assertEqual(self.count(), 250)
+
+    def test_new_part_files_are_appended(self):
+        self.generate(0, 200, 100)
+        self.load()
+        rng = np.random.default_rng(2)
+        extra = data_gen.generate_donations(rng, data_gen.generate_donors(rng, 50), 50, start=200)
+        sink = data_gen.ParquetSink(self.data.name)
+        sink.parts["donations"] = 2  # continue the existing dataset instead of replacing it
+        sink.write("donations", extra)
+        rows, touched = self.load()
+        self.assertEqual(rows, 50)
+        self.assertIsNotNone(touched)
+        self.assertEqual(self.count(), 250)
+
+    def test_empty_dataset_loads_no_rows(self):
+        self.generate(0, 0, 100)
+        self.assertEqual(self.load(), (0, None))
+        self.assertEqual(self.count(), 0)
+
+    def test_missing_dataset_is_reported(self):
+        with self.assertRaisesRegex(FileNotFoundError, "data_gen.py --sink parquet"):
+            self.load()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from inventory_engine import InventoryEngine, allocations_from_requests  # noqa: E402
+
+LOTS = pd.DataFrame({
+    "donation_id": ["DN1", "DN2", "DN3"],
+    "blood_type": ["A+", "A+", "O-"],
+    "component": ["plasma", "plasma", "plasma"],
+    "location_id": ["L1", "L2", "L1"],
+    "units": [10, 5, 7],
+    "donation_date": pd.to_datetime(["2026-01-01", "2026-01-03", "2026-01-01"]),
+    "expiry_date": pd.to_datetime(["2026-01-10", "2026-01-20", "2026-01-05"]),
+})
+
+
+def requests(*rows):
+    # (blood_type, component, units_requested, fulfilled_date) of fulfilled requests
+    df = pd.DataFrame(list(rows), columns=["blood_type", "component", "units_requested", "fulfilled_date"])
+    df["fulfilled_date"] = pd.to_datetime(df["fulfilled_date"])
+    df["status"] = "fulfilled"
+    return df
+
+
+def levels(engine, as_of):
+    snapshot = engine.snapshot(as_of)
+    return {tuple(row[:3]): row[3] for row in snapshot.itertuples(index=False)}
+
+
+class SnapshotTest(unittest.TestCase):
+    def test_lots_enter_on_donation_and_leave_after_expiry(self):
+        engine = InventoryEngine.from_frames(LOTS)
+        self.assertEqual(levels(engine, "2025-12-31"), {})
+        self.assertEqual(levels(engine, "2026-01-05"), {("A+", "plasma", "L1"): 10, ("A+", "plasma", "L2"): 5,
+                                                        ("O-", "plasma", "L1"): 7})
+        self.assertEqual(levels(engine, "2026-01-06"), {("A+", "plasma", "L1"): 10, ("A+", "plasma", "L2"): 5})
+        self.assertEqual(levels(engine, "2026-01-21"), {})
+        self.assertEqual(engine.available("2026-01-04", "B+", "plasma", "L1"), 0)
+
+    def test_no_lots_gives_empty_stock(self):
+        engine = InventoryEngine.from_frames(LOTS.iloc[:0], allocations_from_requests(requests(), LOTS.iloc[:0]))
+        self.assertTrue(engine.snapshot("2026-01-05").empty)
+        self.assertEqual(engine.available("2026-01-05", "A+", "plasma", "L1"), 0)
+
+    def test_allocation_cancels_its_lots_expiry(self):
+        allocations = pd.DataFrame({
+            "blood_type": ["A+"], "component": ["plasma"], "location_id": ["L1"], "units": [4],
+            "allocated_date": pd.to_datetime(["2026-01-05"]), "expiry_date": pd.to_datetime(["2026-01-10"]),
+        })
+        engine = InventoryEngine.from_frames(LOTS, allocations)
+        self.assertEqual(engine.available("2026-01-04", "A+", "plasma", "L1"), 10)
+        self.assertEqual(engine.available("2026-01-05", "A+", "plasma", "L1"), 6)
+        self.assertEqual(engine.available("2026-01-11", "A+", "plasma", "L1"), 0)
+
+
+class FallbackAllocationTest(unittest.TestCase):
+    # allocations_from_requests stands in for the allocations table until allocation.py has run
+
+    def test_fulfilled_request_never_leaves_negative_stock(self):
+        engine = InventoryEngine.from_frames(LOTS, allocations_from_requests(requests(("A+", "plasma", 4, "2026-01-05")), LOTS))
+        self.assertEqual(engine.available("2026-01-05", "A+", "plasma", "L1"), 6)
+        self.assertEqual(engine.available("2026-01-11", "A+", "plasma", "L1"), 0)
+        self.assertEqual(engine.available("2026-01-11", "A+", "plasma", "L2"), 5)
+        for day in pd.date_range("2025-12-31", "2026-01-22"):
+            self.assertTrue(all(units > 0 for units in levels(engine, day).values()), day)
+
+    def test_requests_are_matched_first_expired_first_out_within_stock(self):
+        # 12 units on Jan 4: all 10 of the L1 lot (expires first), then 2 from L2;
+        # the Jan 6 request can only get L2's last 3 units; Jan 2 predates A+ stock at L2
+        # and O- expired on Jan 5
+        allocations = allocations_from_requests(requests(
+            ("A+", "plasma", 12, "2026-01-04"), ("A+", "plasma", 9, "2026-01-06"), ("O-", "plasma", 1, "2026-01-06"),
+        ), LOTS)
+        self.assertEqual(allocations[["location_id", "units"]].values.tolist(), [["L1", 10], ["L2", 2], ["L2", 3]])
+        self.assertEqual(allocations["donation_id"].tolist(), ["DN1", "DN2", "DN2"])
+        engine = InventoryEngine.from_frames(LOTS, allocations)
+        self.assertEqual(levels(engine, "2026-01-06"), {})
+        self.assertEqual(levels(engine, "2026-01-21"), {})
+
+    def test_units_are_not_taken_before_donation_or_after_expiry(self):
+        allocations = allocations_from_requests(requests(
+            ("A+", "plasma", 1, "2025-12-31"), ("A+", "plasma", 1, "2026-01-21"),
+        ), LOTS)
+        self.assertTrue(allocations.empty)
+
+
+if __name__ == "__main__":
+    unittest.main()
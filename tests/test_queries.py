@@ -0,0 +1,103 @@
+import itertools
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import etl_loader  # noqa: E402
+import queries  # noqa: E402
+import storage  # noqa: E402
+import wastage  # noqa: E402
+
+
+class EmptyResultTest(unittest.TestCase):
+    def setUp(self):
+        self.data = tempfile.TemporaryDirectory()
+        self.addCleanup(self.data.cleanup)
+        self.backend = storage.SqliteStorage(os.path.join(self.data.name, "blood_inventory.db"))
+
+    def test_empty_wastage_daily(self):
+        conn = sqlite3.connect(self.backend.path)
+        empty = wastage.wastage_daily(pd.DataFrame(columns=wastage.KEYS), pd.Timestamp("2026-03-31"))
+        etl_loader.write_aggregate(conn, "wastage_daily", wastage.TABLES["wastage_daily"], empty)
+        conn.commit()
+        conn.close()
+        rate = queries.wastage_rate(backend=self.backend)
+        self.assertTrue(rate.empty)
+        self.assertEqual(rate.dtype, "float64")
+        self.assertTrue(queries.wastage_rate("A+", "plasma", "L1", backend=self.backend).empty)
+
+    def test_only_text_columns_become_strings(self):
+        df = queries.compact_dtypes(pd.DataFrame({
+            "blood_type": ["A+", None], "alert": ["low", None], "units": pd.Series([None, None], dtype=object),
+        }))
+        self.assertEqual(df["blood_type"].dtype, "category")
+        self.assertEqual(df["alert"].dtype, "string[pyarrow]")
+        self.assertEqual(df["units"].dtype, object)
+
+
+def rows(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "blood_type": rng.choice(["A+", "O-", "AB+"], n),
+        "component": rng.choice(["plasma", "platelets"], n),
+        "location_id": rng.choice(["L1", "L2"], n),
+        "units": rng.integers(1, 10, n),
+    })
+
+
+class FilterIndexTest(unittest.TestCase):
+    def assert_matches_masks(self, frame, values):
+        # values: filter column -> choices tried for it, besides "All"
+        index = queries.FilterIndex(frame)
+        columns = list(values)
+        for chosen in itertools.product(*(["All", *values[col]] for col in columns)):
+            expected = frame
+            for col, value in zip(columns, chosen):
+                if value != "All":
+                    expected = expected[expected[col] == value]
+            with self.subTest(chosen=chosen):
+                pd.testing.assert_frame_equal(index.select(*chosen), expected)
+
+    def test_select_matches_boolean_masks(self):
+        self.assert_matches_masks(rows(), {
+            "blood_type": ["A+", "O-", "AB+", "B-"],
+            "component": ["plasma", "platelets", "whole_blood"],
+            "location_id": ["L1", "L2", "L9"],
+        })
+
+    def test_categorical_keys(self):
+        frame = queries.compact_dtypes(rows().astype({"blood_type": object, "component": object, "location_id": object}))
+        self.assertEqual(frame["blood_type"].dtype, "category")
+        self.assert_matches_masks(frame, {
+            "blood_type": ["A+", "O-", "B-"],
+            "component": ["plasma", "whole_blood"],
+            "location_id": ["L1", "L9"],
+        })
+
+    def test_frame_without_location(self):
+        # As for demand: the location filter is ignored
+        frame = rows().drop(columns="location_id")
+        index = queries.FilterIndex(frame)
+        self.assertEqual(index.columns, ("blood_type", "component"))
+        for blood_type, component in itertools.product(["All", "A+", "B-"], ["All", "plasma"]):
+            expected = frame
+            if blood_type != "All":
+                expected = expected[expected["blood_type"] == blood_type]
+            if component != "All":
+                expected = expected[expected["component"] == component]
+            with self.subTest(blood_type=blood_type, component=component):
+                pd.testing.assert_frame_equal(index.select(blood_type, component, "L1"), expected)
+
+    def test_unfiltered_selection_is_the_frame(self):
+        frame = rows()
+        self.assertIs(queries.FilterIndex(frame).select(), frame)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import etl_loader  # noqa: E402
+import storage  # noqa: E402
+
+
+@unittest.skipIf(storage.duckdb is None, "duckdb is not installed")
+class DuckDBPublishTest(unittest.TestCase):
+    def setUp(self):
+        self.data = tempfile.TemporaryDirectory()
+        self.addCleanup(self.data.cleanup)
+        self.conn = sqlite3.connect(os.path.join(self.data.name, "blood_inventory.db"))
+        self.addCleanup(self.conn.close)
+        self.replica = storage.DuckDBStorage(os.path.join(self.data.name, "blood_inventory.duckdb"))
+        etl_loader.ensure_run_tables(self.conn)
+
+    def run_writing(self, *tables):
+        # One recorded run that (re)writes the given single-row tables
+        run_id = etl_loader.start_run(self.conn, "test")
+        for table in tables:
+            self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self.conn.execute(f"CREATE TABLE {table} (run_id INTEGER NOT NULL)")
+            self.conn.execute(f"INSERT INTO {table} VALUES (?)", (run_id,))
+        etl_loader.finish_run(self.conn, run_id, len(tables), list(tables))
+        self.conn.commit()
+        return run_id
+
+    def test_missing_and_outdated_tables_are_backfilled(self):
+        self.run_writing("donors", "daily_donations")
+        self.assertEqual(sorted(self.replica.publish(self.conn, [])), ["daily_donations", "donors"])
+        # A run the replica missed, then one that only reports its own table
+        missed = self.run_writing("donors", "wastage_daily")
+        self.run_writing("stock_by_type")
+        published = self.replica.publish(self.conn, ["stock_by_type"])
+        self.assertEqual(sorted(published), ["donors", "stock_by_type", "wastage_daily"])
+        self.assertEqual(self.replica.query("SELECT run_id FROM wastage_daily")["run_id"].tolist(), [missed])
+        versions = self.replica.query("SELECT table_name, run_id FROM table_versions ORDER BY table_name")
+        expected = pd.read_sql("SELECT table_name, run_id FROM table_versions ORDER BY table_name", self.conn)
+        self.assertEqual(versions.values.tolist(), expected.values.tolist())
+        self.assertEqual(self.replica.publish(self.conn, []), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
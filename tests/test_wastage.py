@@ -0,0 +1,82 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from wastage import projected_expiries, wastage_daily  # noqa: E402
+
+AS_OF = pd.Timestamp("2026-01-10")
+# A1: expired on 01-04 with 7 of its 10 units unused; A2: discarded by QC;
+# A3: live, 6 unallocated units expiring on 01-15; O1: live past the horizon;
+# O2: expires on the as-of day itself, so it is still usable
+LOTS = pd.DataFrame({
+    "donation_id": ["A1", "A2", "A3", "O1", "O2"],
+    "blood_type": ["A+", "A+", "A+", "O-", "O-"],
+    "component": ["plasma"] * 5,
+    "location_id": ["L1", "L1", "L1", "L2", "L2"],
+    "units": [10, 5, 8, 4, 3],
+    "donation_date": pd.to_datetime(["2026-01-01", "2026-01-02", "2026-01-05", "2026-01-08", "2026-01-09"]),
+    "expiry_date": pd.to_datetime(["2026-01-04", "2026-01-30", "2026-01-15", "2026-02-28", "2026-01-10"]),
+    "qc_pass": [1, 0, 1, 1, 1],
+    "allocated_units": [3, 0, 2, 0, 0],
+})
+
+
+def series(daily, column, blood_type="A+"):
+    rows = daily[daily["blood_type"] == blood_type]
+    return dict(zip(rows["date"].dt.strftime("%m-%d"), rows[column]))
+
+
+class ProjectedExpiriesTest(unittest.TestCase):
+    def test_unallocated_units_within_the_horizon(self):
+        forecast = projected_expiries(LOTS, AS_OF, horizon_days=14)
+        self.assertEqual(
+            [(d.strftime("%m-%d"), bt, units) for d, bt, units in forecast[["expiry_date", "blood_type", "units"]].itertuples(index=False)],
+            [("01-10", "O-", 3), ("01-15", "A+", 6)],
+        )
+
+    def test_short_horizon_excludes_later_expiries(self):
+        forecast = projected_expiries(LOTS, AS_OF, horizon_days=1)
+        self.assertEqual(forecast["units"].tolist(), [3])
+
+
+class WastageDailyTest(unittest.TestCase):
+    def test_leftover_lands_on_expiry_day_and_discards_on_donation_day(self):
+        daily = wastage_daily(LOTS, AS_OF, window_days=3)
+        expired, discarded = series(daily, "expired_units"), series(daily, "discarded_units")
+        self.assertEqual({day: units for day, units in expired.items() if units}, {"01-04": 7})
+        self.assertEqual({day: units for day, units in discarded.items() if units}, {"01-02": 5})
+        # O2 expires on the as-of day, so none of it is wasted yet
+        self.assertEqual(series(daily, "expired_units", "O-")["01-10"], 0)
+
+    def test_window_shorter_than_history(self):
+        daily = wastage_daily(LOTS, AS_OF, window_days=3)
+        self.assertEqual(len(daily), 10 * 2)  # 01-01..01-10 for both keys
+        collected = series(daily, "collected_units_window")
+        wasted = series(daily, "wasted_units_window")
+        self.assertEqual([collected[f"01-{d:02d}"] for d in range(1, 11)], [10, 15, 15, 5, 8, 8, 8, 0, 0, 0])
+        self.assertEqual([wasted[f"01-{d:02d}"] for d in range(1, 11)], [0, 5, 5, 12, 7, 7, 0, 0, 0, 0])
+        rate = series(daily, "wastage_rate")
+        self.assertAlmostEqual(rate["01-05"], 7 / 8)
+        self.assertTrue(np.isnan(rate["01-08"]))
+
+    def test_window_longer_than_history_is_a_running_total(self):
+        daily = wastage_daily(LOTS, AS_OF, window_days=30)
+        collected = series(daily, "collected_units_window")
+        wasted = series(daily, "wasted_units_window")
+        self.assertEqual(collected["01-10"], 23)
+        self.assertEqual(wasted["01-10"], 12)
+        self.assertEqual(series(daily, "collected_units_window", "O-")["01-10"], 7)
+
+    def test_lots_donated_after_as_of_are_ignored(self):
+        daily = wastage_daily(LOTS, pd.Timestamp("2026-01-06"), window_days=30)
+        self.assertEqual(daily["date"].max(), pd.Timestamp("2026-01-06"))
+        self.assertEqual(series(daily, "collected_units_window")["01-06"], 23)
+        self.assertEqual(series(daily, "collected_units_window", "O-")["01-06"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()